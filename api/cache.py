@@ -0,0 +1,83 @@
+import time
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+
+# Version counters for cached collections.
+# Cached entries embed the version in their key, so bumping the version
+# invalidates every entry of that collection without having to find them.
+# That only works when every process shares the cache (Redis or the
+# database cache). With the per-process memory cache a bump is invisible to
+# the other processes, so there the counters and entries expire after
+# LOCAL_CACHE_MAX_TIMEOUT seconds instead and staleness stays bounded.
+def cache_timeout(timeout):
+    if not isinstance(caches['default'], LocMemCache):
+        return timeout
+    limit = getattr(settings, 'LOCAL_CACHE_MAX_TIMEOUT', 60)
+    return limit if timeout is None else min(timeout, limit)
+
+
+def version_key(namespace):
+    return f'zaptalk:version:{namespace}'
+
+
+def get_cache_version(namespace):
+    version = cache.get(version_key(namespace))
+    if version is None:
+        # Start from the clock rather than 1 so an evicted counter can
+        # never come back to a version that still has entries cached
+        cache.add(
+            version_key(namespace), int(time.time() * 1000),
+            cache_timeout(None)
+        )
+        version = cache.get(version_key(namespace))
+    return version
+
+
+def bump_cache_version(namespace):
+    def bump():
+        try:
+            cache.incr(version_key(namespace))
+        except ValueError:
+            cache.set(
+                version_key(namespace), int(time.time() * 1000),
+                cache_timeout(None)
+            )
+
+    # Readers racing the writer would otherwise cache the old rows
+    # under the new version
+    transaction.on_commit(bump)
+
+
+# Hit and miss counters per cache namespace, shared by every process that
+# uses the same cache backend. See the cache_stats command.
+def metrics_key(namespace, event):
+    return f'zaptalk:metrics:{namespace}:{event}'
+
+
+def record_cache_event(namespace, hit):
+    key = metrics_key(namespace, 'hits' if hit else 'misses')
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def cache_metrics(namespace):
+    hits = cache.get(metrics_key(namespace, 'hits'), 0)
+    misses = cache.get(metrics_key(namespace, 'misses'), 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0,
+    }
+
+
+def reset_cache_metrics(namespace):
+    cache.delete_many([
+        metrics_key(namespace, 'hits'), metrics_key(namespace, 'misses')
+    ])
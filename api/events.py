@@ -0,0 +1,221 @@
+import asyncio
+import json
+import logging
+import threading
+from contextlib import asynccontextmanager
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils.module_loading import import_string
+from .timeline import follower_edges
+
+logger = logging.getLogger('zaptalk_api.api')
+
+
+# Real-time events for the /api/events/ stream.
+# Sync code (requests, the notification worker) publishes events to a
+# target: a list of user ids, or the followers of an actor. The stream view
+# subscribes on the ASGI event loop and gets the events for its user.
+# Followers are resolved where the events are delivered, and only among
+# that process's subscribers, so a celebrity's event never loads their
+# whole follower list. The broker is chosen with settings.EVENT_BROKER:
+# 'memory' only reaches streams served by the same process, 'postgres'
+# relays events between processes and dynos with LISTEN/NOTIFY.
+# Events are sent after the publishing transaction commits, and a broker
+# failure is logged without affecting the write that published the event.
+CHANNEL = 'zaptalk_events'
+# Events kept for a slow client before newer ones are dropped
+QUEUE_SIZE = 100
+# Keeps NOTIFY payloads well under Postgres' 8000 byte limit
+USERS_PER_MESSAGE = 200
+
+
+def offer(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        pass
+
+
+class InProcessBroker:
+    # Whether publish() is already tied to the caller's transaction
+    transactional = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def publish(self, target, event):
+        try:
+            self.dispatch(target, event)
+        except Exception:
+            logger.exception('Could not publish event')
+
+    def recipients(self, target):
+        # User ids of target that have a stream open in this process.
+        # Queries the database for followers, so never call it on the loop.
+        with self.lock:
+            subscribed = list(self.subscribers)
+        if 'followers_of' not in target:
+            return target['users']
+        if not subscribed:
+            return []
+        return list(
+            follower_edges(target['followers_of'])
+            .filter(to_userprofile__user_id__in=subscribed)
+            .values_list('to_userprofile__user_id', flat=True)
+        )
+
+    def dispatch(self, target, event):
+        # Called from any thread, queues are only touched on their own loop
+        user_ids = self.recipients(target)
+        with self.lock:
+            queues = [
+                queue
+                for user_id in user_ids
+                for queue in self.subscribers.get(user_id, ())
+            ]
+        for loop, queue in queues:
+            loop.call_soon_threadsafe(offer, queue, event)
+
+    @asynccontextmanager
+    async def subscribe(self, user_id):
+        # Queue receiving the events for user_id while the block runs
+        target = (
+            asyncio.get_running_loop(), asyncio.Queue(QUEUE_SIZE)
+        )
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(target)
+        try:
+            await self.started()
+            yield target[1]
+        finally:
+            with self.lock:
+                subscribers = self.subscribers.get(user_id, set())
+                subscribers.discard(target)
+                if not subscribers:
+                    self.subscribers.pop(user_id, None)
+
+    async def started(self):
+        pass
+
+
+# Publishes with NOTIFY on the request's own connection, so events are only
+# delivered if its transaction commits. NOTIFY runs in a savepoint, so a
+# failure can't abort the caller's transaction. Each ASGI process keeps a
+# single LISTEN connection, read without blocking from the event loop, and
+# hands the events to its local subscribers.
+class PostgresBroker(InProcessBroker):
+    transactional = True
+
+    def __init__(self):
+        super().__init__()
+        self.listener = None
+
+    def publish(self, target, event):
+        if 'users' in target:
+            users = list(target['users'])
+            messages = [
+                {'users': users[start:start + USERS_PER_MESSAGE]}
+                for start in range(0, len(users), USERS_PER_MESSAGE)
+            ]
+        else:
+            messages = [target]
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                for message in messages:
+                    cursor.execute('SELECT pg_notify(%s, %s)', [
+                        CHANNEL, json.dumps({**message, 'event': event})
+                    ])
+        except DatabaseError:
+            logger.exception('Could not publish event')
+
+    async def started(self):
+        if self.listener is None:
+            self.listener = self.listen(asyncio.get_running_loop())
+
+    def dispatch_in_thread(self, target, event):
+        try:
+            self.dispatch(target, event)
+        except Exception:
+            logger.exception('Could not deliver event')
+        finally:
+            # Executor threads outlive requests, don't keep their connection
+            connection.close()
+
+    def listen(self, loop):
+        import psycopg2
+        import psycopg2.extensions
+
+        params = connection.get_connection_params()
+        listener = psycopg2.connect(**params)
+        listener.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT
+        )
+        with listener.cursor() as cursor:
+            cursor.execute(f'LISTEN {CHANNEL}')
+
+        def read():
+            try:
+                listener.poll()
+            except psycopg2.Error:
+                logger.exception('Event listener connection lost')
+                loop.remove_reader(listener)
+                self.listener = None
+                return
+            while listener.notifies:
+                notify = listener.notifies.pop(0)
+                message = json.loads(notify.payload)
+                event = message.pop('event')
+                if 'followers_of' in message:
+                    # Needs a query, which must not block the event loop
+                    loop.run_in_executor(
+                        None, self.dispatch_in_thread, message, event
+                    )
+                else:
+                    self.dispatch(message, event)
+
+        loop.add_reader(listener, read)
+        return listener
+
+
+BROKERS = {
+    'memory': 'api.events.InProcessBroker',
+    'postgres': 'api.events.PostgresBroker',
+}
+_broker = None
+
+
+def get_broker():
+    # None when real-time events are turned off
+    global _broker
+    name = getattr(settings, 'EVENT_BROKER', None)
+    if not name:
+        return None
+    if _broker is None:
+        _broker = import_string(BROKERS.get(name, name))()
+    return _broker
+
+
+def send(target, event):
+    broker = get_broker()
+    if broker is None:
+        return
+    if broker.transactional:
+        broker.publish(target, event)
+    else:
+        transaction.on_commit(lambda: broker.publish(target, event))
+
+
+def publish(user_ids, event):
+    if user_ids:
+        send({'users': list(user_ids)}, event)
+
+
+def publish_feed_item(actor_id, entry_type, object_id):
+    # Tells the followers of actor_id that their feed has a new item
+    send({'followers_of': actor_id}, {
+        'type': 'feed',
+        'entry_type': entry_type,
+        'id': object_id,
+        'actor': actor_id,
+    })
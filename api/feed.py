@@ -0,0 +1,126 @@
+import base64
+import heapq
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from .models import Comment, Like
+from .timeline import (
+    timeline_enabled,
+    read_on_users,
+    read_timeline,
+    resolve_entries
+)
+
+
+# Activity feed paging.
+# Feed items are ordered newest first by (created_at, type, id), and a page
+# is addressed by an opaque cursor holding that key for the last item seen.
+# Every stream (comments, likes, ...) reads only the rows after the cursor,
+# newest first and limited to one page, then the streams are merged.
+FEED_PAGE_SIZE = 20
+FEED_MAX_PAGE_SIZE = 50
+
+
+def feed_key(item):
+    return (item.created_at, item.feed_type, item.feed_id)
+
+
+def encode_cursor(item):
+    created_at, item_type, pk = feed_key(item)
+    raw = f'{created_at.isoformat()}|{item_type}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(value):
+    # Raises ValueError for anything that is not a cursor we issued
+    try:
+        raw = base64.urlsafe_b64decode(value.encode()).decode()
+        created_at, item_type, pk = raw.split('|')
+        created_at = parse_datetime(created_at)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f'Invalid cursor: {value}') from e
+    if created_at is None:
+        raise ValueError(f'Invalid cursor: {value}')
+    return created_at, item_type, pk
+
+
+def after_cursor(queryset, item_type, cursor):
+    # Rows of one stream that sort strictly after the cursor
+    if cursor is None:
+        return queryset
+    created_at, cursor_type, pk = cursor
+    if item_type < cursor_type:
+        return queryset.filter(created_at__lte=created_at)
+    if item_type > cursor_type:
+        return queryset.filter(created_at__lt=created_at)
+    return queryset.filter(
+        Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+    )
+
+
+def read_stream(item_type, queryset, cursor, page_size):
+    rows = list(
+        after_cursor(queryset, item_type, cursor)
+        .order_by('-created_at', '-pk')[:page_size + 1]
+    )
+    for row in rows:
+        row.feed_type = item_type
+        row.feed_id = row.pk
+    return rows
+
+
+# Merges rows read from several streams (each newest first, at most
+# page_size + 1 long). Returns the page and the cursor for the next one,
+# or None at the end.
+def merge_pages(pages, page_size=FEED_PAGE_SIZE):
+    merged = []
+    for row in heapq.merge(*pages, key=feed_key, reverse=True):
+        # The same item can come from the timeline and a source table
+        if not merged or feed_key(merged[-1]) != feed_key(row):
+            merged.append(row)
+    page = merged[:page_size]
+    next_cursor = (
+        encode_cursor(page[-1]) if len(merged) > page_size else None
+    )
+    return page, next_cursor
+
+
+# Reads one page from each (item_type, queryset) stream and merges them
+def merge_streams(streams, cursor=None, page_size=FEED_PAGE_SIZE):
+    return merge_pages(
+        [
+            read_stream(item_type, queryset, cursor, page_size)
+            for item_type, queryset in streams
+        ],
+        page_size
+    )
+
+
+def source_streams(user_ids):
+    return [
+        ('comment', Comment.objects.filter(user__in=user_ids)),
+        ('like', Like.objects.filter(user__in=user_ids)),
+    ]
+
+
+# One page of comments and likes by the users that user follows.
+# Reads the materialized timeline when fan-out-on-write is enabled and
+# merges in the authors that are read on demand.
+def build_feed(user, cursor=None, page_size=FEED_PAGE_SIZE):
+    if not timeline_enabled():
+        following_users = (
+            user.profile.following.values_list('user', flat=True)
+        )
+        return merge_streams(
+            source_streams(following_users), cursor, page_size
+        )
+
+    pages = [read_timeline(user.pk, cursor, page_size)]
+    read_on = read_on_users(user.profile)
+    if read_on:
+        pages += [
+            read_stream(item_type, queryset, cursor, page_size)
+            for item_type, queryset in source_streams(read_on)
+        ]
+    page, next_cursor = merge_pages(pages, page_size)
+    return resolve_entries(page), next_cursor
@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from api.recommendations import rebuild_follow_suggestions
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the "who to follow" suggestions from the likes, comments '
+        'and follows of every user'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top', type=int, default=20,
+            help='Suggestions stored per user (default 20)'
+        )
+        parser.add_argument(
+            '--block-size', type=int, default=256,
+            help='Users scored per matrix product (default 256). Memory use '
+                 'peaks at about block size x number of users x 12 bytes, '
+                 'whatever the number of movies and comments'
+        )
+
+    def handle(self, *args, **options):
+        if options['top'] < 1 or options['block_size'] < 1:
+            raise CommandError('--top and --block-size must be at least 1')
+        started = time.monotonic()
+        with transaction.atomic():
+            total = rebuild_follow_suggestions(
+                options['top'], options['block_size']
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {total} follow suggestions in '
+            f'{time.monotonic() - started:.1f}s'
+        ))
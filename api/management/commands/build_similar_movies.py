@@ -0,0 +1,39 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from api.recommendations import build_similar_movies
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the similar movies of new movies and of movies whose likes '
+        'changed substantially, from genres, cast and likes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Rebuild every movie, so older lists pick up new movies'
+        )
+        parser.add_argument(
+            '--top', type=int, default=20,
+            help='Similar movies stored per movie (default 20)'
+        )
+        parser.add_argument(
+            '--block-size', type=int, default=256,
+            help='Movies scored per matrix product (default 256). Memory use '
+                 'is about block size x number of movies x 4 bytes'
+        )
+
+    def handle(self, *args, **options):
+        if options['top'] < 1 or options['block_size'] < 1:
+            raise CommandError('--top and --block-size must be at least 1')
+        started = time.monotonic()
+        with transaction.atomic():
+            movies, total = build_similar_movies(
+                options['top'], options['block_size'], options['full']
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {movies} movies ({total} similar movies) in '
+            f'{time.monotonic() - started:.1f}s'
+        ))
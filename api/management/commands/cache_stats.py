@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from api.cache import cache_metrics, reset_cache_metrics
+
+NAMESPACES = ['movie_list', 'movie_facets']
+
+
+class Command(BaseCommand):
+    help = 'Show hit and miss counts of the response caches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Set the counters back to zero after printing them'
+        )
+
+    def handle(self, *args, **options):
+        for namespace in NAMESPACES:
+            metrics = cache_metrics(namespace)
+            self.stdout.write(
+                f"{namespace}: {metrics['hits']} hits, "
+                f"{metrics['misses']} misses "
+                f"({metrics['hit_rate']:.1%} hit rate)"
+            )
+            if options['reset']:
+                reset_cache_metrics(namespace)
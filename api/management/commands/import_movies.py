@@ -1,40 +1,253 @@
 import json
-from django.core.management.base import BaseCommand
-from api.models import Movie
+import time
+from itertools import islice
+from multiprocessing import Pool
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from api.cache import bump_cache_version
+from api.models import Movie, MovieRanking
+
+MOVIE_FIELDS = [
+    'title',
+    'year',
+    'cast',
+    'genres',
+    'href',
+    'extract',
+    'thumbnail',
+    'thumbnail_width',
+    'thumbnail_height',
+]
+
+
+# Yields the items of a top-level JSON array one at a time, reading the
+# file in chunks so the whole dump never has to be in memory
+def iter_json_array(file, chunk_size=1 << 16):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if not started:
+            if buffer.startswith('['):
+                buffer = buffer[1:]
+                started = True
+                continue
+            if buffer or eof:
+                raise ValueError('Expected a JSON array')
+        else:
+            if buffer.startswith(','):
+                buffer = buffer[1:]
+                continue
+            if buffer.startswith(']'):
+                return
+            if buffer:
+                try:
+                    item, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError:
+                    # Item is cut off at the end of the buffer, read more
+                    if eof:
+                        raise
+                else:
+                    # A number ending the buffer may go on in the next chunk
+                    if end < len(buffer) or eof:
+                        yield item
+                        buffer = buffer[end:]
+                        continue
+            elif eof:
+                raise ValueError('Unterminated JSON array')
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+
+
+def as_int(value, field, required=False):
+    if value is None and not required:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f'{field} must be an integer')
+    return int(value)
+
+
+def as_str(value, field, max_length=None, default=''):
+    if value is None:
+        return default
+    if not isinstance(value, str):
+        raise ValueError(f'{field} must be a string')
+    if max_length and len(value) > max_length:
+        raise ValueError(f'{field} is longer than {max_length} characters')
+    return value
+
+
+def as_str_list(value, field):
+    if value is None:
+        return []
+    if not isinstance(value, list) or not all(
+        isinstance(item, str) for item in value
+    ):
+        raise ValueError(f'{field} must be a list of strings')
+    return value
+
+
+# Turns one raw record into Movie field values, raising ValueError
+def clean_movie(data):
+    if not isinstance(data, dict):
+        raise ValueError('record must be an object')
+    return {
+        'title': as_str(data.get('title'), 'title', 200),
+        'year': as_int(data.get('year', 0), 'year', required=True),
+        'cast': as_str_list(data.get('cast'), 'cast'),
+        'genres': as_str_list(data.get('genres'), 'genres'),
+        'href': as_str(data.get('href'), 'href', 200, default=None),
+        'extract': as_str(data.get('extract'), 'extract'),
+        'thumbnail': as_str(data.get('thumbnail'), 'thumbnail', 500),
+        'thumbnail_width': as_int(
+            data.get('thumbnail_width'), 'thumbnail_width'
+        ),
+        'thumbnail_height': as_int(
+            data.get('thumbnail_height'), 'thumbnail_height'
+        ),
+    }
+
+
+# Validates a chunk of (index, record) pairs; runs in worker processes
+# when --workers is set, so it must stay a module-level function
+def clean_chunk(chunk):
+    cleaned, errors = [], []
+    for index, data in chunk:
+        try:
+            cleaned.append((index, clean_movie(data)))
+        except (ValueError, TypeError) as e:
+            errors.append((index, str(e), data))
+    return cleaned, errors
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def match_key(values):
+    # Records are the same movie when they share an href,
+    # or when neither has one and title and year match
+    if values['href']:
+        return ('href', values['href'])
+    return ('title', values['title'], values['year'])
+
 
 class Command(BaseCommand):
     help = 'Import movies from JSON file'
 
     def add_arguments(self, parser):
-        parser.add_argument('json_file', type=str, help='Path to the JSON file')
+        parser.add_argument(
+            'json_file', type=str, help='Path to the JSON file'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Movies written per transaction (default 1000)'
+        )
+        parser.add_argument(
+            '--upsert', action='store_true',
+            help='Update movies that already exist (matched on href, or on '
+                 'title and year) instead of creating duplicates'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=0,
+            help='Validate records in this many processes (default: inline)'
+        )
 
     def handle(self, *args, **kwargs):
-        json_file = kwargs['json_file']
-        with open(json_file, 'r') as file:
-            movies_data = json.load(file)
-
-        success_count = 0
-        error_count = 0
-
-        for index, movie_data in enumerate(movies_data):
-            try:
-                Movie.objects.create(
-                    title=movie_data.get('title', ''),
-                    year=movie_data.get('year', 0),
-                    cast=movie_data.get('cast', []),
-                    genres=movie_data.get('genres', []),
-                    href=movie_data.get('href', None),
-                    extract=movie_data.get('extract', ''),
-                    thumbnail=movie_data.get('thumbnail', ''),
-                    thumbnail_width=movie_data.get('thumbnail_width'),
-                    thumbnail_height=movie_data.get('thumbnail_height')
-                )
-                success_count += 1
-            except Exception as e:
-                error_count += 1
-                self.stdout.write(self.style.ERROR(f'Error importing movie at index {index}: {str(e)}'))
-                self.stdout.write(self.style.ERROR(f'Problematic data: {movie_data}'))
-
-        self.stdout.write(self.style.SUCCESS(f'Successfully imported {success_count} movies'))
-        if error_count > 0:
-            self.stdout.write(self.style.WARNING(f'Encountered errors while importing {error_count} movies'))
\ No newline at end of file
+        batch_size = kwargs['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        self.upsert = kwargs['upsert']
+
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        self.started = time.monotonic()
+
+        with open(kwargs['json_file'], 'r') as file:
+            chunks = chunked(enumerate(iter_json_array(file)), batch_size)
+            if kwargs['workers'] > 0:
+                with Pool(kwargs['workers']) as pool:
+                    for result in pool.imap(clean_chunk, chunks):
+                        self.write_batch(*result)
+            else:
+                for chunk in chunks:
+                    self.write_batch(*clean_chunk(chunk))
+
+        bump_cache_version('movies')
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully imported {self.created + self.updated} movies '
+            f'({self.created} created, {self.updated} updated) '
+            f'in {time.monotonic() - self.started:.1f}s'
+        ))
+        if self.error_count > 0:
+            self.stdout.write(self.style.WARNING(
+                f'Encountered errors while importing '
+                f'{self.error_count} movies'
+            ))
+
+    def write_batch(self, cleaned, errors):
+        for index, message, data in errors:
+            self.error_count += 1
+            self.stdout.write(self.style.ERROR(
+                f'Error importing movie at index {index}: {message}'
+            ))
+            self.stdout.write(self.style.ERROR(f'Problematic data: {data}'))
+
+        # Later records in the file win over earlier ones with the same key
+        records = {}
+        for index, values in cleaned:
+            key = match_key(values) if self.upsert else index
+            records[key] = values
+
+        with transaction.atomic():
+            existing = self.find_existing(records) if self.upsert else {}
+            new = [
+                Movie(**values)
+                for key, values in records.items()
+                if key not in existing
+            ]
+            changed = []
+            for key, movie in existing.items():
+                for field in MOVIE_FIELDS:
+                    setattr(movie, field, records[key][field])
+                changed.append(movie)
+
+            Movie.objects.bulk_create(new)
+            Movie.objects.bulk_update(changed, MOVIE_FIELDS)
+            Movie.bulk_sync_genre_tags(new + changed)
+            Movie.bulk_sync_cast_members(new + changed)
+            # bulk_create skips the post_save receiver that adds these
+            MovieRanking.objects.bulk_create(
+                [MovieRanking(movie=movie) for movie in new],
+                ignore_conflicts=True
+            )
+
+        self.created += len(new)
+        self.updated += len(changed)
+        processed = self.created + self.updated + self.error_count
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(
+            f'Processed {processed} records '
+            f'({processed / elapsed if elapsed else 0:.0f} records/s)'
+        )
+
+    def find_existing(self, records):
+        hrefs = [key[1] for key in records if key[0] == 'href']
+        titles = [key[1] for key in records if key[0] == 'title']
+        existing = {}
+        for movie in Movie.objects.filter(href__in=hrefs):
+            existing[('href', movie.href)] = movie
+        for movie in Movie.objects.filter(
+            Q(href__isnull=True) | Q(href=''), title__in=titles
+        ):
+            key = ('title', movie.title, movie.year)
+            if key in records:
+                existing[key] = movie
+        return existing
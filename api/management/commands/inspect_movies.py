@@ -1,19 +1,128 @@
+import json
+from collections import Counter
 from django.core.management.base import BaseCommand
 from api.models import Movie
 
+
+# Counter that never holds more than about 2 * capacity keys.
+# When it grows past that it keeps only the capacity most common keys, so
+# the counts of rare keys are dropped but the top of the list stays right
+# for the long-tailed data it is used on (cast names).
+class BoundedCounter(Counter):
+    def __init__(self, capacity):
+        super().__init__()
+        self.capacity = capacity
+        self.pruned = False
+
+    def add(self, keys):
+        self.update(keys)
+        if len(self) > 2 * self.capacity:
+            kept = dict(self.most_common(self.capacity))
+            self.clear()
+            self.update(kept)
+            self.pruned = True
+
+
 class Command(BaseCommand):
-    help = 'Inspect movie genres in the database'
+    help = 'Print genre, year, cast and data quality statistics for movies'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Rows fetched from the database at a time (default 2000)'
+        )
+        parser.add_argument(
+            '--top', type=int, default=20,
+            help='Number of cast members to list (default 20)'
+        )
+        parser.add_argument(
+            '--cast-capacity', type=int, default=10000,
+            help='Distinct cast names kept in memory (default 10000)'
+        )
+        parser.add_argument(
+            '--json', action='store_true', help='Output the statistics as JSON'
+        )
 
     def handle(self, *args, **options):
-        movies = Movie.objects.all()
-        for movie in movies:
-            self.stdout.write(f"Movie: {movie.title}")
-            self.stdout.write(f"Genres: {movie.genres}")
-        
-        unique_genres = set()
-        for movie in movies:
-            unique_genres.update(movie.genres)
-        
+        stats = self.collect(options)
+        if options['json']:
+            self.stdout.write(json.dumps(stats, indent=2))
+        else:
+            self.write_report(stats)
+
+    def collect(self, options):
+        genres = Counter()
+        years = Counter()
+        cast = BoundedCounter(options['cast_capacity'])
+        quality = Counter()
+        total = 0
+
+        # Only the small columns, streamed with a server-side cursor where
+        # the database supports it, so memory use does not grow with the
+        # size of the catalog
+        rows = Movie.objects.order_by().values_list(
+            'year', 'genres', 'cast', 'thumbnail', 'href'
+        ).iterator(chunk_size=options['chunk_size'])
+        for year, movie_genres, movie_cast, thumbnail, href in rows:
+            total += 1
+            years[year] += 1
+            if movie_genres:
+                genres.update(movie_genres)
+            else:
+                quality['empty_genres'] += 1
+            if movie_cast:
+                cast.add(movie_cast)
+            else:
+                quality['empty_cast'] += 1
+            if not thumbnail:
+                quality['missing_thumbnail'] += 1
+            if not href:
+                quality['missing_href'] += 1
+            if not year:
+                quality['missing_year'] += 1
+
+        return {
+            'total_movies': total,
+            'genres': dict(genres.most_common()),
+            'years': dict(sorted(years.items())),
+            'decades': dict(sorted(self.decades(years).items())),
+            'top_cast': dict(cast.most_common(options['top'])),
+            'cast_counts_approximate': cast.pruned,
+            'data_quality': {
+                key: quality[key]
+                for key in (
+                    'empty_genres',
+                    'empty_cast',
+                    'missing_thumbnail',
+                    'missing_href',
+                    'missing_year',
+                )
+            },
+        }
+
+    def decades(self, years):
+        decades = Counter()
+        for year, total in years.items():
+            if year:
+                decades[year // 10 * 10] += total
+        return decades
+
+    def write_report(self, stats):
+        self.stdout.write(f"Movies: {stats['total_movies']}")
+
         self.stdout.write("\nUnique genres:")
-        for genre in sorted(unique_genres):
-            self.stdout.write(genre)
\ No newline at end of file
+        for genre, total in sorted(stats['genres'].items()):
+            self.stdout.write(f"{genre}: {total}")
+
+        self.stdout.write("\nMovies per decade:")
+        for decade, total in stats['decades'].items():
+            self.stdout.write(f"{decade}s: {total}")
+
+        note = ' (approximate)' if stats['cast_counts_approximate'] else ''
+        self.stdout.write(f"\nMost frequent cast{note}:")
+        for name, total in stats['top_cast'].items():
+            self.stdout.write(f"{name}: {total}")
+
+        self.stdout.write("\nData quality:")
+        for key, total in stats['data_quality'].items():
+            self.stdout.write(f"{key.replace('_', ' ').capitalize()}: {total}")
@@ -0,0 +1,34 @@
+import time
+from django.core.management.base import BaseCommand
+from api.notifications import BATCH_SIZE, process_outbox, prune_events
+
+
+class Command(BaseCommand):
+    help = 'Turn queued notification events into notifications'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Drain the outbox once and exit instead of polling'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=2.0,
+            help='Seconds to wait when the outbox is empty (default 2)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE,
+            help=f'Events coalesced per transaction (default {BATCH_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            total = process_outbox(options['batch_size'])
+            pruned = prune_events()
+            if total or options['once']:
+                self.stdout.write(
+                    f'Processed {total} events, pruned {pruned}'
+                )
+            if options['once']:
+                return
+            if not total:
+                time.sleep(options['interval'])
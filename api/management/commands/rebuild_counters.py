@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from api.models import Movie, Comment, Like, Notification, UserProfile
+
+
+def count_subquery(queryset, field, outer='pk'):
+    # Correlated COUNT(*) for the row being updated, 0 when nothing matches
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef(outer)})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the denormalized like, comment and unread notification '
+        'counters in bulk'
+    )
+
+    def handle(self, *args, **options):
+        movie_likes = Like.objects.filter(
+            content_type=Movie.get_default_like_content_type()
+        )
+        comment_likes = Like.objects.filter(
+            content_type=Comment.get_default_like_content_type()
+        )
+
+        with transaction.atomic():
+            movies = Movie.objects.update(
+                likes_count=count_subquery(movie_likes, 'object_id'),
+                comments_count=count_subquery(Comment.objects.all(), 'movie')
+            )
+            comments = Comment.objects.update(
+                likes_count=count_subquery(comment_likes, 'object_id')
+            )
+            profiles = UserProfile.objects.update(
+                unread_notifications_count=count_subquery(
+                    Notification.objects.filter(is_read=False),
+                    'recipient',
+                    outer='user'
+                )
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt counters for {movies} movies, {comments} comments '
+            f'and {profiles} profiles'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.timeline import rebuild_timelines
+
+
+class Command(BaseCommand):
+    help = 'Rebuild every materialized feed timeline from the follow graph'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            total = rebuild_timelines()
+        self.stdout.write(
+            self.style.SUCCESS(f'Wrote {total} timeline entries')
+        )
@@ -0,0 +1,18 @@
+import time
+from django.core.management.base import BaseCommand
+from api.rankings import refresh_rankings
+
+
+class Command(BaseCommand):
+    help = (
+        'Refresh the all-time and trending movie rankings used by '
+        'sort=popular and sort=trending'
+    )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        all_time, trending = refresh_rankings()
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated {all_time} all-time and {trending} trending scores in '
+            f'{time.monotonic() - started:.1f}s'
+        ))
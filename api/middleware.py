@@ -0,0 +1,96 @@
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('zaptalk_api.queries')
+
+
+# Records every SQL statement run while handling one request
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.statements[(sql, repr(params))] += 1
+
+    @property
+    def duplicates(self):
+        return self.count - len(self.statements)
+
+    def most_duplicated(self, limit=5):
+        return [
+            (sql, total)
+            for (sql, params), total in self.statements.most_common(limit)
+            if total > 1
+        ]
+
+
+def diagnostics_requested(request):
+    # Expensive diagnostics run when asked for with the debug header
+    # (any value in DEBUG, the configured token otherwise) or for a
+    # random sample of requests
+    header = request.headers.get('X-Debug-Queries')
+    token = getattr(settings, 'QUERY_DIAGNOSTICS_TOKEN', None)
+    if header and (settings.DEBUG or (token and header == token)):
+        return True
+    rate = getattr(settings, 'QUERY_DIAGNOSTICS_SAMPLE_RATE', 0.0)
+    return rate > 0 and random.random() < rate
+
+
+def diagnostics_enabled(request):
+    return getattr(request, 'query_diagnostics', False)
+
+
+# Counts the queries, SQL time and duplicate statements of each request,
+# reports them in X-DB-* and Server-Timing response headers and logs them
+# per view. Sets request.query_diagnostics for views that have extra,
+# costly logging to do.
+class QueryInstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.query_diagnostics = diagnostics_requested(request)
+        stats = QueryStats()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+
+        duration_ms = stats.duration * 1000
+        response['X-DB-Query-Count'] = str(stats.count)
+        response['X-DB-Query-Time'] = f'{duration_ms:.1f}'
+        response['X-DB-Duplicate-Queries'] = str(stats.duplicates)
+        response['Server-Timing'] = (
+            f'db;dur={duration_ms:.1f};desc="{stats.count} queries"'
+        )
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else request.path
+        budget = getattr(settings, 'QUERY_BUDGET', 50)
+        level = (
+            logging.WARNING if stats.count > budget
+            else logging.INFO if request.query_diagnostics
+            else logging.DEBUG
+        )
+        logger.log(
+            level,
+            f"{request.method} {view}: {stats.count} queries, "
+            f"{duration_ms:.1f}ms SQL, {stats.duplicates} duplicates"
+        )
+        if request.query_diagnostics:
+            for sql, total in stats.most_duplicated():
+                logger.info(f"Duplicated {total}x: {sql}")
+        return response
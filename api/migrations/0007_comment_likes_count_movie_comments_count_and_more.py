@@ -0,0 +1,71 @@
+# Generated by Django 5.1.1 on 2026-10-17 11:11
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(queryset, field):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0
+    )
+
+
+def populate_counters(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Like = apps.get_model('api', 'Like')
+    Movie = apps.get_model('api', 'Movie')
+    Comment = apps.get_model('api', 'Comment')
+
+    movie_type = ContentType.objects.filter(
+        app_label='api', model='movie'
+    ).first()
+    comment_type = ContentType.objects.filter(
+        app_label='api', model='comment'
+    ).first()
+
+    Movie.objects.update(
+        comments_count=count_subquery(Comment.objects.all(), 'movie')
+    )
+    if movie_type:
+        Movie.objects.update(likes_count=count_subquery(
+            Like.objects.filter(content_type=movie_type), 'object_id'
+        ))
+    if comment_type:
+        Comment.objects.update(likes_count=count_subquery(
+            Like.objects.filter(content_type=comment_type), 'object_id'
+        ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_notification'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.1 on 2026-10-17 11:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_comment_likes_count_movie_comments_count_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Genre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('slug', models.SlugField(max_length=100, unique=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MovieGenre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('genre', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.genre')),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.movie')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='genre_tags',
+            field=models.ManyToManyField(blank=True, related_name='movies', through='api.MovieGenre', to='api.genre'),
+        ),
+        migrations.AddIndex(
+            model_name='moviegenre',
+            index=models.Index(fields=['genre', 'movie'], name='api_moviege_genre_i_8db3ae_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='moviegenre',
+            unique_together={('movie', 'genre')},
+        ),
+    ]
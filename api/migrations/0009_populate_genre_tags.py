@@ -0,0 +1,57 @@
+from django.db import migrations
+from django.utils.text import slugify
+
+
+BATCH_SIZE = 1000
+
+
+def populate_genre_tags(apps, schema_editor):
+    Movie = apps.get_model('api', 'Movie')
+    Genre = apps.get_model('api', 'Genre')
+    MovieGenre = apps.get_model('api', 'MovieGenre')
+
+    movie_slugs = []
+    names = {}
+    for movie_id, genres in (
+        Movie.objects.values_list('id', 'genres').iterator(chunk_size=2000)
+    ):
+        slugs = set()
+        for name in genres or []:
+            slug = slugify(name) if isinstance(name, str) else ''
+            if slug:
+                names.setdefault(slug, name.strip())
+                slugs.add(slug)
+        movie_slugs.append((movie_id, slugs))
+
+    Genre.objects.bulk_create(
+        [Genre(name=name, slug=slug) for slug, name in names.items()],
+        ignore_conflicts=True
+    )
+    genre_ids = dict(Genre.objects.values_list('slug', 'id'))
+
+    links = []
+    for movie_id, slugs in movie_slugs:
+        for slug in slugs:
+            links.append(
+                MovieGenre(movie_id=movie_id, genre_id=genre_ids[slug])
+            )
+            if len(links) >= BATCH_SIZE:
+                MovieGenre.objects.bulk_create(links, ignore_conflicts=True)
+                links = []
+    MovieGenre.objects.bulk_create(links, ignore_conflicts=True)
+
+
+def clear_genre_tags(apps, schema_editor):
+    apps.get_model('api', 'MovieGenre').objects.all().delete()
+    apps.get_model('api', 'Genre').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_genre_moviegenre_movie_genre_tags_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_genre_tags, clear_genre_tags),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-17 11:15
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_comment_api_comment_user_id_478dc3_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('comment', 'Comment'), ('like', 'Like')], max_length=10)),
+                ('object_id', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField()),
+                ('actor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', '-created_at', '-entry_type', '-object_id'], name='api_timelin_owner_i_27f17e_idx'), models.Index(fields=['owner', 'actor'], name='api_timelin_owner_i_e986a9_idx'), models.Index(fields=['entry_type', 'object_id'], name='api_timelin_entry_t_1c7ee2_idx')],
+                'unique_together': {('owner', 'entry_type', 'object_id')},
+            },
+        ),
+    ]
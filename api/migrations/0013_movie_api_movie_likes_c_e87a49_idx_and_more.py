@@ -0,0 +1,21 @@
+# Generated by Django 5.1.1 on 2026-10-17 11:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['-likes_count', '-id'], name='api_movie_likes_c_e87a49_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['-comments_count', '-id'], name='api_movie_comment_280351_idx'),
+        ),
+    ]
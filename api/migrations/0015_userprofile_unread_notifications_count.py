@@ -0,0 +1,41 @@
+# Generated by Django 5.1.1 on 2026-10-17 11:25
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_unread_counts(apps, schema_editor):
+    Notification = apps.get_model('api', 'Notification')
+    UserProfile = apps.get_model('api', 'UserProfile')
+
+    UserProfile.objects.update(unread_notifications_count=Coalesce(
+        Subquery(
+            Notification.objects.filter(
+                recipient=OuterRef('user'), is_read=False
+            )
+            .order_by()
+            .values('recipient')
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_notificationevent_notification_object_id_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='unread_notifications_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(
+            populate_unread_counts, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.1 on 2026-10-17 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_followsuggestion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='similarity_likes_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='MovieSimilarity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similarities', to='api.movie')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_to', to='api.movie')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['movie', 'rank'], name='api_moviesi_movie_i_5d160c_idx')],
+                'unique_together': {('movie', 'similar')},
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.1 on 2026-10-17 11:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_movie_similarity_likes_count_moviesimilarity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Person',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('slug', models.SlugField(allow_unicode=True, max_length=200, unique=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MovieCast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.movie')),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.person')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='cast_members',
+            field=models.ManyToManyField(blank=True, related_name='movies', through='api.MovieCast', to='api.person'),
+        ),
+        migrations.AddIndex(
+            model_name='moviecast',
+            index=models.Index(fields=['person', 'movie'], name='api_movieca_person__01a215_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='moviecast',
+            unique_together={('movie', 'person')},
+        ),
+    ]
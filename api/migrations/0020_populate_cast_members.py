@@ -0,0 +1,66 @@
+from django.db import migrations
+from django.utils.text import slugify
+
+
+BATCH_SIZE = 1000
+NAME_LENGTH = 200
+
+
+def person_slug(name):
+    name = name.strip()[:NAME_LENGTH]
+    return slugify(name) or slugify(name, allow_unicode=True)
+
+
+def populate_cast_members(apps, schema_editor):
+    Movie = apps.get_model('api', 'Movie')
+    Person = apps.get_model('api', 'Person')
+    MovieCast = apps.get_model('api', 'MovieCast')
+
+    movie_slugs = []
+    names = {}
+    for movie_id, cast in (
+        Movie.objects.values_list('id', 'cast').iterator(chunk_size=2000)
+    ):
+        slugs = {}
+        for name in cast or []:
+            slug = person_slug(name) if isinstance(name, str) else ''
+            if slug:
+                names.setdefault(slug, name.strip()[:NAME_LENGTH])
+                slugs.setdefault(slug, len(slugs))
+        movie_slugs.append((movie_id, slugs))
+
+    Person.objects.bulk_create(
+        [Person(name=name, slug=slug) for slug, name in names.items()],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+    person_ids = dict(Person.objects.values_list('slug', 'id'))
+
+    links = []
+    for movie_id, slugs in movie_slugs:
+        for slug, position in slugs.items():
+            links.append(MovieCast(
+                movie_id=movie_id,
+                person_id=person_ids[slug],
+                position=position
+            ))
+            if len(links) >= BATCH_SIZE:
+                MovieCast.objects.bulk_create(links, ignore_conflicts=True)
+                links = []
+    MovieCast.objects.bulk_create(links, ignore_conflicts=True)
+
+
+def clear_cast_members(apps, schema_editor):
+    apps.get_model('api', 'MovieCast').objects.all().delete()
+    apps.get_model('api', 'Person').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_person_moviecast_movie_cast_members_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_cast_members, clear_cast_members),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.1 on 2026-10-17 11:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_populate_cast_members'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovieRanking',
+            fields=[
+                ('movie', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ranking', serialize=False, to='api.movie')),
+                ('all_time_score', models.FloatField(default=0)),
+                ('trending_score', models.FloatField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-all_time_score', '-movie'], name='api_moviera_all_tim_af0702_idx'), models.Index(fields=['-trending_score', '-movie'], name='api_moviera_trendin_75f50b_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+BATCH_SIZE = 1000
+# Same as api.rankings.COMMENT_WEIGHT when this migration was written
+COMMENT_WEIGHT = 2.0
+
+
+def populate_movie_rankings(apps, schema_editor):
+    Movie = apps.get_model('api', 'Movie')
+    MovieRanking = apps.get_model('api', 'MovieRanking')
+
+    rankings = []
+    for movie_id, likes_count, comments_count in (
+        Movie.objects.values_list('id', 'likes_count', 'comments_count')
+        .iterator(chunk_size=2000)
+    ):
+        rankings.append(MovieRanking(
+            movie_id=movie_id,
+            all_time_score=likes_count + COMMENT_WEIGHT * comments_count
+        ))
+        if len(rankings) >= BATCH_SIZE:
+            MovieRanking.objects.bulk_create(rankings, ignore_conflicts=True)
+            rankings = []
+    MovieRanking.objects.bulk_create(rankings, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_movieranking'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            populate_movie_rankings, migrations.RunPython.noop
+        ),
+    ]
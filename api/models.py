@@ -1,4 +1,8 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import (
+    Count, Exists, F, OuterRef, Subquery, Sum, Value
+)
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import (
@@ -7,9 +11,13 @@ from django.contrib.contenttypes.fields import (
 )
 from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
+from django.utils.text import slugify
 from cloudinary.models import CloudinaryField
-from django.db.models.signals import post_save
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_save
+)
 from django.dispatch import receiver
+from .cache import bump_cache_version
 
 User = get_user_model()
 
@@ -22,6 +30,15 @@ def create_or_update_user_profile(sender, instance, created, **kwargs):
         instance.profile.save()
 
 
+# Moves a denormalized counter column by delta with a single UPDATE,
+# never letting it drop below zero
+def adjust_counter(model, pk, field, delta):
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
 # Creates a default content type for the likes
 # That changes inside of comments/movies
 def get_default_content_type():
@@ -37,16 +54,108 @@ class Like(models.Model):
 
     class Meta:
         unique_together = ('user', 'content_type', 'object_id')
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id']),
+            # Likes of one movie or comment
+            models.Index(fields=['content_type', 'object_id']),
+        ]
 
     def __str__(self):
         return f"{self.user.username} likes {self.content_object}"
 
 
+class Genre(models.Model):
+    name = models.CharField(max_length=100)
+    # Normalized lookup key, "Science Fiction" -> "science-fiction"
+    slug = models.SlugField(max_length=100, unique=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def for_names(cls, names):
+        # Returns the Genre rows for names, creating any that are missing
+        by_slug = {slugify(name): name.strip() for name in names if name}
+        by_slug.pop('', None)
+        existing = cls.objects.filter(slug__in=by_slug)
+        missing = set(by_slug) - {genre.slug for genre in existing}
+        if missing:
+            cls.objects.bulk_create(
+                [cls(name=by_slug[slug], slug=slug) for slug in missing],
+                ignore_conflicts=True
+            )
+        return list(cls.objects.filter(slug__in=by_slug))
+
+
+def person_slug(name):
+    # "Penélope Cruz" -> "penelope-cruz"; names with no ASCII letters
+    # keep their own
+    name = name.strip()[:Person.NAME_LENGTH]
+    return slugify(name) or slugify(name, allow_unicode=True)
+
+
+class Person(models.Model):
+    NAME_LENGTH = 200
+    # Keeps IN lists well below SQLite's bound parameter limit
+    LOOKUP_BATCH_SIZE = 5000
+
+    name = models.CharField(max_length=NAME_LENGTH)
+    # Normalized lookup key, also serves prefix searches for autocomplete
+    slug = models.SlugField(
+        max_length=NAME_LENGTH, unique=True, allow_unicode=True
+    )
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def for_names(cls, names):
+        # Returns the Person rows for names, creating any that are missing
+        by_slug = {}
+        for name in names:
+            if isinstance(name, str):
+                by_slug.setdefault(
+                    person_slug(name), name.strip()[:cls.NAME_LENGTH]
+                )
+        by_slug.pop('', None)
+        people = []
+        slugs = list(by_slug)
+        for start in range(0, len(slugs), cls.LOOKUP_BATCH_SIZE):
+            batch = slugs[start:start + cls.LOOKUP_BATCH_SIZE]
+            existing = set(
+                cls.objects.filter(slug__in=batch)
+                .values_list('slug', flat=True)
+            )
+            cls.objects.bulk_create(
+                [
+                    cls(name=by_slug[slug], slug=slug)
+                    for slug in batch if slug not in existing
+                ],
+                ignore_conflicts=True
+            )
+            people.extend(cls.objects.filter(slug__in=batch))
+        return people
+
+
 class Movie(models.Model):
     title = models.CharField(max_length=200)
     year = models.IntegerField(default=0)
     cast = models.JSONField(default=list)
     genres = models.JSONField(default=list)
+    # Indexed copy of `genres`, used for filtering
+    genre_tags = models.ManyToManyField(
+        Genre, through='MovieGenre', related_name='movies', blank=True
+    )
+    # Indexed copy of `cast`, used for filtering
+    cast_members = models.ManyToManyField(
+        Person, through='MovieCast', related_name='movies', blank=True
+    )
     href = models.CharField(max_length=200, null=True, blank=True)
     extract = models.TextField(default='')
     thumbnail = models.URLField(
@@ -56,24 +165,227 @@ class Movie(models.Model):
     thumbnail_width = models.IntegerField(null=True, blank=True)
     thumbnail_height = models.IntegerField(null=True, blank=True)
     likes = GenericRelation(Like, related_query_name='movie')
+    # Denormalized counters, kept in sync by the Like/Comment signals below
+    # and rebuilt in bulk with `manage.py rebuild_counters`
+    likes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+    # likes_count when the movie's MovieSimilarity rows were last built,
+    # empty if they never were (see build_similar_movies)
+    similarity_likes_count = models.PositiveIntegerField(
+        null=True, blank=True
+    )
+
+    class Meta:
+        # Back sort=most_liked / most_commented
+        indexes = [
+            models.Index(fields=['-likes_count', '-id']),
+            models.Index(fields=['-comments_count', '-id']),
+        ]
 
     @staticmethod
     def get_default_like_content_type():
         return ContentType.objects.get_for_model(Movie)
 
-    @property
-    def likes_count(self):
-        return self.likes.count()
+    def sync_genre_tags(self):
+        self.genre_tags.set(Genre.for_names(self.genres or []))
+
+    @classmethod
+    def bulk_sync_genre_tags(cls, movies):
+        # sync_genre_tags for many saved movies at once, for bulk writes
+        # that skip the post_save signal
+        genres = {
+            genre.slug: genre
+            for genre in Genre.for_names(
+                {name for movie in movies for name in movie.genres or []}
+            )
+        }
+        MovieGenre.objects.filter(movie__in=movies).delete()
+        MovieGenre.objects.bulk_create(
+            [
+                MovieGenre(movie=movie, genre=genres[slug])
+                for movie in movies
+                for slug in {slugify(name) for name in movie.genres or []}
+                if slug in genres
+            ],
+            batch_size=1000,
+            ignore_conflicts=True
+        )
 
-    @property
-    def comments_count(self):
-        from .models import Comment  # Import here to avoid circular import
-        return Comment.objects.filter(movie=self).count()
+    def sync_cast_members(self):
+        Movie.bulk_sync_cast_members([self])
+
+    @classmethod
+    def bulk_sync_cast_members(cls, movies):
+        # Rebuilds the MovieCast rows of saved movies from their cast,
+        # keeping billing order
+        people = {
+            person.slug: person
+            for person in Person.for_names(
+                {name for movie in movies for name in movie.cast or []}
+            )
+        }
+        MovieCast.objects.filter(movie__in=movies).delete()
+        links = []
+        for movie in movies:
+            slugs = {}
+            for name in movie.cast or []:
+                if isinstance(name, str):
+                    slugs.setdefault(person_slug(name), len(slugs))
+            links.extend(
+                MovieCast(movie=movie, person=people[slug], position=position)
+                for slug, position in slugs.items()
+                if slug in people
+            )
+        MovieCast.objects.bulk_create(
+            links, batch_size=1000, ignore_conflicts=True
+        )
 
     def __str__(self):
         return self.title
 
 
+class MovieGenre(models.Model):
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
+    genre = models.ForeignKey(Genre, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('movie', 'genre')
+        # Serves genre -> movies semi-joins without touching the movie table
+        indexes = [models.Index(fields=['genre', 'movie'])]
+
+
+@receiver(post_save, sender=Movie)
+def sync_movie_genre_tags(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'genres' in update_fields:
+        instance.sync_genre_tags()
+
+
+class MovieCast(models.Model):
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
+    person = models.ForeignKey(Person, on_delete=models.CASCADE)
+    # Billing order in Movie.cast, 0 for the lead
+    position = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('movie', 'person')
+        # Serves person -> movies semi-joins without touching the movie table
+        indexes = [models.Index(fields=['person', 'movie'])]
+
+
+@receiver(post_save, sender=Movie)
+def sync_movie_cast_members(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'cast' in update_fields:
+        instance.sync_cast_members()
+
+
+# Every movie has a ranking row, so sorted browsing can join on it
+@receiver(post_save, sender=Movie)
+def create_movie_ranking(sender, instance, created, **kwargs):
+    if created:
+        MovieRanking.objects.bulk_create(
+            [MovieRanking(movie=instance)], ignore_conflicts=True
+        )
+
+
+# Invalidates everything cached under the 'movies' version
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+def bump_movies_cache_version(sender, **kwargs):
+    bump_cache_version('movies')
+
+
+# Popularity scores behind sort=popular and sort=trending, refreshed
+# periodically by the refresh_rankings command (api/rankings.py)
+class MovieRanking(models.Model):
+    movie = models.OneToOneField(
+        Movie, on_delete=models.CASCADE, primary_key=True,
+        related_name='ranking'
+    )
+    # Likes plus weighted comments, ever
+    all_time_score = models.FloatField(default=0)
+    # The same with every like and comment decaying by half each
+    # TRENDING_HALF_LIFE
+    trending_score = models.FloatField(default=0)
+
+    class Meta:
+        # Ordered reads for the sorts, newest movie first on ties
+        indexes = [
+            models.Index(fields=['-all_time_score', '-movie']),
+            models.Index(fields=['-trending_score', '-movie']),
+        ]
+
+    def __str__(self):
+        return f"Ranking of {self.movie_id}"
+
+
+# Scalar subquery over rows matching OuterRef, 0 when there are none
+def subquery_total(queryset, field, aggregate):
+    return Coalesce(
+        Subquery(
+            queryset.order_by()
+            .values(field)
+            .annotate(total=aggregate)
+            .values('total')
+        ),
+        0
+    )
+
+
+# Annotates is_liked_by_user on Movie or Comment rows with an EXISTS
+# subquery for user, so serializers don't run a query per row
+def with_like_state(queryset, user):
+    if user is None or not user.is_authenticated:
+        return queryset.annotate(is_liked_by_user=Value(False))
+    return queryset.annotate(is_liked_by_user=Exists(
+        Like.objects.filter(
+            user=user,
+            content_type=ContentType.objects.get_for_model(queryset.model),
+            object_id=OuterRef('pk')
+        )
+    ))
+
+
+class UserProfileQuerySet(models.QuerySet):
+    def with_stats(self, viewer=None):
+        # Everything UserProfileSerializer shows, in a single statement
+        follows = UserProfile.followers.through.objects
+        viewer_profile = (
+            UserProfile.objects.filter(user=viewer).values('pk')
+            if viewer is not None and viewer.is_authenticated
+            else None
+        )
+        return self.select_related('user').annotate(
+            comment_count=subquery_total(
+                Comment.objects.filter(user=OuterRef('user')),
+                'user', Count('pk')
+            ),
+            total_likes_received=subquery_total(
+                Comment.objects.filter(user=OuterRef('user')),
+                'user', Sum('likes_count')
+            ),
+            # followers edges point from the followed profile to the follower
+            followers_count=subquery_total(
+                follows.filter(from_userprofile=OuterRef('pk')),
+                'from_userprofile', Count('pk')
+            ),
+            following_count=subquery_total(
+                follows.filter(to_userprofile=OuterRef('pk')),
+                'to_userprofile', Count('pk')
+            ),
+            viewer_is_following=(
+                Exists(follows.filter(
+                    from_userprofile=OuterRef('pk'),
+                    to_userprofile__in=viewer_profile
+                ))
+                if viewer_profile is not None
+                else Value(False)
+            ),
+            banned=Exists(
+                Ban.objects.filter(user=OuterRef('user'), is_active=True)
+            ),
+        )
+
+
 class UserProfile(models.Model):
     user = models.OneToOneField(
         User, on_delete=models.CASCADE, related_name='profile'
@@ -86,6 +398,10 @@ class UserProfile(models.Model):
     followers = models.ManyToManyField(
         'self', symmetrical=False, related_name='following'
     )
+    # Denormalized, kept up to date by api/notifications.py
+    unread_notifications_count = models.PositiveIntegerField(default=0)
+
+    objects = UserProfileQuerySet.as_manager()
 
     def __str__(self):
         return self.user.username
@@ -94,8 +410,9 @@ class UserProfile(models.Model):
         return self.user.comment_set.count()
 
     def get_total_likes_received(self):
-        comments = self.user.comment_set.all()
-        return sum(comment.likes.count() for comment in comments)
+        return self.user.comment_set.aggregate(
+            total=Coalesce(Sum('likes_count'), 0)
+        )['total']
 
     def get_followers_count(self):
         return self.followers.count()
@@ -106,8 +423,35 @@ class UserProfile(models.Model):
     def is_following(self, user_to_check):
         return self.following.filter(user=user_to_check).exists()
 
+    # Follow graph writes. followers edges point from the followed profile
+    # to the follower, and the (from, to) unique index answers follows()
+    # without loading anyone's follower list.
+    def follows(self, profile):
+        return UserProfile.followers.through.objects.filter(
+            from_userprofile=profile, to_userprofile=self
+        ).exists()
+
+    def follow(self, profile):
+        # True when the follow is new, False when it already existed
+        if self.follows(profile):
+            return False
+        try:
+            with transaction.atomic():
+                profile.followers.add(self)
+        except IntegrityError:
+            # Added by a concurrent request
+            return False
+        return True
+
+    def unfollow(self, profile):
+        # True when there was a follow to remove
+        if not self.follows(profile):
+            return False
+        profile.followers.remove(self)
+        return True
+
     def is_banned(self):
-        return hasattr(self.user, 'ban') and self.user.ban.is_active
+        return self.user.bans.filter(is_active=True).exists()
 
 
 class Comment(models.Model):
@@ -119,6 +463,10 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     likes = GenericRelation(Like, related_query_name='comment')
+    likes_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', '-created_at', '-id'])]
 
     @staticmethod
     def get_default_like_content_type():
@@ -128,6 +476,65 @@ class Comment(models.Model):
         return f'Comment by {self.user.username} on {self.movie.title}'
 
 
+# Keeps Movie.likes_count and Comment.likes_count in step with the Like table
+@receiver(post_save, sender=Like)
+def increment_like_counter(sender, instance, created, **kwargs):
+    if created:
+        adjust_like_counter(instance, 1)
+        from .timeline import fan_out  # Import here to avoid circular import
+        fan_out(instance.user_id, 'like', instance.pk, instance.created_at)
+        from .events import publish_feed_item
+        publish_feed_item(instance.user_id, 'like', instance.pk)
+
+
+@receiver(post_delete, sender=Like)
+def decrement_like_counter(sender, instance, **kwargs):
+    adjust_like_counter(instance, -1)
+    from .timeline import remove_entries
+    remove_entries('like', instance.pk)
+
+
+def adjust_like_counter(like, delta):
+    # get_for_id is served from the ContentType cache, no query needed
+    model = ContentType.objects.get_for_id(like.content_type_id).model_class()
+    if model in (Movie, Comment):
+        adjust_counter(model, like.object_id, 'likes_count', delta)
+
+
+# Keeps Movie.comments_count in step with the Comment table, including
+# comments moved to another movie
+@receiver(pre_save, sender=Comment)
+def remember_comment_movie(sender, instance, **kwargs):
+    instance._previous_movie_id = (
+        Comment.objects.filter(pk=instance.pk)
+        .values_list('movie_id', flat=True).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Comment)
+def increment_comment_counter(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_movie_id', None)
+    if not created and previous and previous != instance.movie_id:
+        adjust_counter(Movie, previous, 'comments_count', -1)
+        adjust_counter(Movie, instance.movie_id, 'comments_count', 1)
+    if created:
+        adjust_counter(Movie, instance.movie_id, 'comments_count', 1)
+        from .timeline import fan_out
+        fan_out(
+            instance.user_id, 'comment', instance.pk, instance.created_at
+        )
+        from .events import publish_feed_item
+        publish_feed_item(instance.user_id, 'comment', instance.pk)
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comment_counter(sender, instance, **kwargs):
+    adjust_counter(Movie, instance.movie_id, 'comments_count', -1)
+    from .timeline import remove_entries
+    remove_entries('comment', instance.pk)
+
+
 class Ban(models.Model):
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name='bans'
@@ -177,11 +584,21 @@ class Notification(models.Model):
     notification_type = models.CharField(
         max_length=20, choices=NOTIFICATION_TYPES
     )
+    # Liked comment id for likes, None for follows
+    object_id = models.PositiveIntegerField(null=True, blank=True)
+    # Other senders coalesced into this notification, see
+    # api/notifications.py ("alice and 12 others liked your comment")
+    others_count = models.PositiveIntegerField(default=0)
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['recipient', 'notification_type', 'object_id']
+            ),
+        ]
 
     def __str__(self):
         return (
@@ -189,3 +606,155 @@ class Notification(models.Model):
             f"{self.get_notification_type_display()}ed "
             f"{self.recipient.username}"
         )
+
+
+# Keeps UserProfile.unread_notifications_count in step with single
+# notifications saved or deleted (including cascades). Bulk writes in
+# api/notifications.py adjust the counter themselves.
+@receiver(post_save, sender=Notification)
+def count_new_notification(sender, instance, created, **kwargs):
+    from .notifications import adjust_unread
+    if created and not instance.is_read:
+        adjust_unread(instance.recipient_id, 1)
+
+
+@receiver(post_delete, sender=Notification)
+def count_deleted_notification(sender, instance, **kwargs):
+    from .notifications import adjust_unread
+    if not instance.is_read:
+        adjust_unread(instance.recipient_id, -1)
+
+
+# Outbox of notifications waiting to be written.
+# Requests only insert a row here; the process_notifications worker turns
+# them into coalesced Notification rows, see api/notifications.py.
+# Processed events are kept for the coalescing window to spot repeats.
+class NotificationEvent(models.Model):
+    recipient = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='+'
+    )
+    sender = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='+'
+    )
+    notification_type = models.CharField(
+        max_length=20, choices=Notification.NOTIFICATION_TYPES
+    )
+    object_id = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['processed_at', 'id']),
+            models.Index(
+                fields=[
+                    'recipient', 'notification_type', 'object_id',
+                    'created_at'
+                ]
+            ),
+        ]
+
+    def __str__(self):
+        return (
+            f"{self.notification_type} from {self.sender_id} "
+            f"to {self.recipient_id}"
+        )
+
+
+# Materialized feed, one row per item per follower.
+# Only written when settings.TIMELINE_FANOUT is on, see api/timeline.py
+class TimelineEntry(models.Model):
+    ENTRY_TYPES = (
+        ('comment', 'Comment'),
+        ('like', 'Like'),
+    )
+
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='timeline_entries'
+    )
+    actor = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='+'
+    )
+    entry_type = models.CharField(max_length=10, choices=ENTRY_TYPES)
+    # Comment or Like id, depending on entry_type
+    object_id = models.PositiveIntegerField()
+    # Copied from the comment or like so entries sort like the feed
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('owner', 'entry_type', 'object_id')
+        indexes = [
+            models.Index(
+                fields=['owner', '-created_at', '-entry_type', '-object_id']
+            ),
+            models.Index(fields=['owner', 'actor']),
+            models.Index(fields=['entry_type', 'object_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.entry_type} {self.object_id} for {self.owner_id}"
+
+
+# Backfills or trims timelines whenever a follow is added or removed
+@receiver(m2m_changed, sender=UserProfile.followers.through)
+def sync_timelines_on_follow(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    from .timeline import follow_changed
+    if action == 'pre_clear':
+        # pk_set is not sent for clears, collect the edges being removed
+        related = instance.following if reverse else instance.followers
+        pk_set = set(related.values_list('pk', flat=True))
+        action = 'post_remove'
+    if action in ('post_add', 'post_remove'):
+        for pk in pk_set:
+            # followers edges point from the followed profile to the follower
+            followed, follower = (pk, instance.pk) if reverse else (
+                instance.pk, pk
+            )
+            follow_changed(follower, followed, action == 'post_add')
+
+
+# Precomputed "who to follow", rebuilt offline by the
+# build_follow_suggestions command (api/recommendations.py)
+class FollowSuggestion(models.Model):
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='follow_suggestions'
+    )
+    suggested = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='+'
+    )
+    # Cosine similarity of the two users' likes, comments and follows
+    score = models.FloatField()
+    # 1 for the best suggestion
+    rank = models.PositiveSmallIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'suggested')
+        indexes = [models.Index(fields=['user', 'rank'])]
+
+    def __str__(self):
+        return f"{self.suggested_id} for {self.user_id}"
+
+
+# Precomputed "more like this", built offline by the build_similar_movies
+# command (api/recommendations.py)
+class MovieSimilarity(models.Model):
+    movie = models.ForeignKey(
+        Movie, on_delete=models.CASCADE, related_name='similarities'
+    )
+    similar = models.ForeignKey(
+        Movie, on_delete=models.CASCADE, related_name='similar_to'
+    )
+    # Weighted cosine similarity of genres, cast and likes
+    score = models.FloatField()
+    # 1 for the most similar movie
+    rank = models.PositiveSmallIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('movie', 'similar')
+        indexes = [models.Index(fields=['movie', 'rank'])]
+
+    def __str__(self):
+        return f"{self.similar_id} similar to {self.movie_id}"
@@ -0,0 +1,201 @@
+from datetime import timedelta
+from collections import Counter
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .events import publish
+from .models import Notification, NotificationEvent, UserProfile
+
+
+# Notification outbox.
+# create_notification only inserts a NotificationEvent, so follows and likes
+# do not pay for building notifications. The process_notifications worker
+# drains the outbox in batches and coalesces events for the same recipient,
+# type and object within NOTIFICATION_COALESCE_WINDOW into one notification:
+# an unread notification is updated with the newest sender and a count of
+# the others, and senders already notified in the window (follow/unfollow
+# toggles, unlike/like) are not notified again.
+BATCH_SIZE = 500
+
+
+def coalesce_window():
+    return timedelta(
+        seconds=getattr(settings, 'NOTIFICATION_COALESCE_WINDOW', 3600)
+    )
+
+
+def process_sync():
+    # Without a worker (local development) events are processed as soon as
+    # the request's transaction commits
+    return getattr(settings, 'NOTIFICATION_OUTBOX_SYNC', False)
+
+
+def enqueue(recipient, sender, notification_type, object_id=None):
+    NotificationEvent.objects.create(
+        recipient=recipient,
+        sender=sender,
+        notification_type=notification_type,
+        object_id=object_id
+    )
+    if process_sync():
+        transaction.on_commit(process_outbox)
+
+
+# Unread notification badge.
+# The count lives in UserProfile.unread_notifications_count; every change
+# goes through adjust_unread, which updates the column with an F()
+# expression. It is read straight from the row: a primary key lookup is
+# cheap, and a per-process cache would miss writes made by the worker and
+# by other web processes.
+def unread_count(user_id):
+    return UserProfile.objects.filter(user_id=user_id).values_list(
+        'unread_notifications_count', flat=True
+    ).first() or 0
+
+
+def adjust_unread(user_id, delta):
+    if not delta:
+        return
+    profiles = UserProfile.objects.filter(user_id=user_id)
+    if delta < 0:
+        profiles = profiles.filter(unread_notifications_count__gte=-delta)
+    profiles.update(
+        unread_notifications_count=F('unread_notifications_count') + delta
+    )
+
+
+def mark_read(notifications):
+    # Marks a queryset of notifications read and returns how many changed
+    with transaction.atomic():
+        changed = Counter()
+        unread = notifications.filter(is_read=False)
+        for recipient_id in unread.select_for_update().values_list(
+            'recipient_id', flat=True
+        ):
+            changed[recipient_id] += 1
+        unread.update(is_read=True)
+        for recipient_id, total in changed.items():
+            adjust_unread(recipient_id, -total)
+    return sum(changed.values())
+
+
+def event_key(event):
+    return (event.recipient_id, event.notification_type, event.object_id)
+
+
+def keys_filter(keys):
+    condition = Q()
+    for recipient_id, notification_type, object_id in keys:
+        condition |= Q(
+            recipient_id=recipient_id,
+            notification_type=notification_type,
+            object_id=object_id
+        )
+    return condition
+
+
+def process_batch(batch_size=BATCH_SIZE):
+    # Coalesces one batch of pending events and returns how many it took.
+    # skip_locked lets several workers share the outbox on Postgres.
+    now = timezone.now()
+    cutoff = now - coalesce_window()
+    with transaction.atomic():
+        events = list(
+            NotificationEvent.objects
+            .filter(processed_at__isnull=True)
+            .select_for_update(skip_locked=True)
+            .order_by('id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        pending = {}
+        for event in events:
+            pending.setdefault(event_key(event), []).append(event)
+        keys = keys_filter(pending)
+
+        # Senders already notified about each key within the window
+        notified = {}
+        for *key, sender_id in (
+            NotificationEvent.objects
+            .filter(keys, processed_at__isnull=False, created_at__gte=cutoff)
+            .values_list(
+                'recipient_id', 'notification_type', 'object_id',
+                'sender_id'
+            )
+            .distinct()
+        ):
+            notified.setdefault(tuple(key), set()).add(sender_id)
+
+        unread = {}
+        for notification in (
+            Notification.objects
+            .filter(keys, is_read=False, created_at__gte=cutoff)
+            .order_by('created_at')
+        ):
+            # The newest unread notification for a key wins
+            unread[event_key(notification)] = notification
+
+        created, updated = [], []
+        for key, key_events in pending.items():
+            seen = notified.get(key, set())
+            senders = []
+            for event in key_events:
+                if event.sender_id not in seen:
+                    seen.add(event.sender_id)
+                    senders.append(event.sender_id)
+            if not senders:
+                continue
+            notification = unread.get(key)
+            if notification is None:
+                created.append(Notification(
+                    recipient_id=key[0],
+                    sender_id=senders[-1],
+                    notification_type=key[1],
+                    object_id=key[2],
+                    others_count=len(senders) - 1
+                ))
+            else:
+                notification.sender_id = senders[-1]
+                notification.others_count += len(senders)
+                notification.created_at = now
+                updated.append(notification)
+
+        Notification.objects.bulk_create(created)
+        for recipient_id, total in Counter(
+            notification.recipient_id for notification in created
+        ).items():
+            adjust_unread(recipient_id, total)
+        Notification.objects.bulk_update(
+            updated, ['sender', 'others_count', 'created_at']
+        )
+        NotificationEvent.objects.filter(
+            pk__in=[event.pk for event in events]
+        ).update(processed_at=now)
+        for notification in created + updated:
+            publish([notification.recipient_id], {
+                'type': 'notification',
+                'id': notification.pk,
+                'notification_type': notification.notification_type,
+                'sender': notification.sender_id,
+                'object_id': notification.object_id,
+                'others_count': notification.others_count,
+            })
+    return len(events)
+
+
+def prune_events():
+    # Processed events are only needed while they can still coalesce
+    deleted, _ = NotificationEvent.objects.filter(
+        processed_at__isnull=False,
+        created_at__lt=timezone.now() - coalesce_window()
+    ).delete()
+    return deleted
+
+
+def process_outbox(batch_size=BATCH_SIZE):
+    total = 0
+    while processed := process_batch(batch_size):
+        total += processed
+    return total
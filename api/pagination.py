@@ -0,0 +1,167 @@
+import base64
+import json
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+# Pagination to only load 24 pages
+class StandardResultsSetPagination(PageNumberPagination):
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+# Keyset ("seek") pagination.
+# Instead of COUNT(*) + OFFSET, each page continues from the sort values of
+# the last row of the previous page, so page 100 costs the same as page 1.
+# The ordering is taken from the queryset (or the view's keyset_ordering)
+# and the primary key is appended to break ties. Ordering fields must be
+# plain fields or annotations that are never NULL.
+class KeysetPagination(BasePagination):
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    ordering = ('-pk',)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self, queryset, view):
+        if queryset.query.order_by:
+            ordering = list(queryset.query.order_by)
+        elif queryset.ordered:
+            ordering = list(queryset.model._meta.ordering)
+        else:
+            ordering = list(getattr(view, 'keyset_ordering', self.ordering))
+        if not all(isinstance(field, str) for field in ordering):
+            raise ValueError('Keyset pagination needs field name ordering')
+        if not {'pk', '-pk', 'id', '-id'} & set(ordering):
+            ordering.append('-pk' if ordering[0].startswith('-') else 'pk')
+        return ordering
+
+    def encode_cursor(self, values):
+        raw = json.dumps(values, default=str, separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, value, queryset):
+        # Cursor values converted to the ordering fields' Python types, so a
+        # tampered cursor is a 404 rather than an error building the query
+        try:
+            values = json.loads(base64.urlsafe_b64decode(value.encode()))
+            if (
+                not isinstance(values, list)
+                or len(values) != len(self.ordering)
+                or None in values
+            ):
+                raise ValueError(values)
+            return [
+                field.to_python(value)
+                for field, value in zip(self.ordering_fields(queryset), values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def ordering_fields(self, queryset):
+        fields = []
+        for name in self.ordering:
+            name = name.lstrip('-')
+            if name in queryset.query.annotations:
+                fields.append(queryset.query.annotations[name].output_field)
+                continue
+            model = queryset.model
+            for part in name.split('__'):
+                field = (
+                    model._meta.pk if part == 'pk'
+                    else model._meta.get_field(part)
+                )
+                model = field.related_model
+            fields.append(field)
+        return fields
+
+    def after(self, values):
+        # Rows strictly after the cursor in the current ordering:
+        # (a > x) OR (a = x AND b > y) OR ... with < for descending fields
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def row_values(self, row):
+        values = []
+        for field in self.ordering:
+            value = row
+            for attr in field.lstrip('-').split('__'):
+                value = getattr(value, attr)
+            values.append(value)
+        return values
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(queryset, view)
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(
+                self.after(self.decode_cursor(cursor, queryset))
+            )
+
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        cursor = self.encode_cursor(self.row_values(self.page[-1]))
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, cursor
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data
+        })
+
+
+# Page numbers by default, keyset pages when the client sends ?cursor=
+# (empty for the first page)
+class CursorOrPagePagination(StandardResultsSetPagination):
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.keyset_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+# Unpaginated by default, keyset pages when the client sends ?cursor=
+class OptionalKeysetPagination(KeysetPagination):
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
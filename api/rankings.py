@@ -0,0 +1,96 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, FloatField, OuterRef, Q, Subquery
+from django.utils import timezone
+from .models import Comment, Like, Movie, MovieRanking
+
+
+# Popularity rankings behind sort=popular and sort=trending.
+# all_time_score is a movie's likes plus COMMENT_WEIGHT per comment, read
+# from the denormalized counters. trending_score weighs each like and
+# comment by 0.5 ** (age / TRENDING_HALF_LIFE), so recent activity beats
+# old favourites. Both are as fresh as the last refresh_rankings run.
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+# Activity older than this many half-lives adds under 0.1% of its weight
+# and is left out
+WINDOW_HALF_LIVES = 10
+CHUNK_SIZE = 10000
+BATCH_SIZE = 1000
+
+
+def half_life():
+    return getattr(settings, 'TRENDING_HALF_LIFE', 60 * 60 * 72)
+
+
+def trending_scores(now):
+    # Decayed activity per movie id, for the movies active in the window
+    cutoff = now - timedelta(seconds=half_life() * WINDOW_HALF_LIVES)
+    activity = [
+        (
+            Like.objects.filter(
+                content_type=Movie.get_default_like_content_type()
+            ),
+            'object_id',
+            LIKE_WEIGHT
+        ),
+        (Comment.objects, 'movie_id', COMMENT_WEIGHT),
+    ]
+    scores = defaultdict(float)
+    for queryset, field, weight in activity:
+        for movie_id, created_at in (
+            queryset.filter(created_at__gte=cutoff)
+            .order_by()
+            .values_list(field, 'created_at')
+            .iterator(chunk_size=CHUNK_SIZE)
+        ):
+            age = max((now - created_at).total_seconds(), 0)
+            scores[movie_id] += weight * 0.5 ** (age / half_life())
+    return scores
+
+
+def refresh_rankings(now=None):
+    # Returns how many all-time and trending scores changed
+    now = now or timezone.now()
+    with transaction.atomic():
+        # Movies written by bulk_create have no ranking row yet
+        MovieRanking.objects.bulk_create(
+            [
+                MovieRanking(movie_id=movie_id)
+                for movie_id in Movie.objects.filter(
+                    ranking__isnull=True
+                ).values_list('id', flat=True)
+            ],
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True
+        )
+
+        all_time = Subquery(
+            Movie.objects.filter(pk=OuterRef('movie')).values(
+                score=F('likes_count') + COMMENT_WEIGHT * F('comments_count')
+            ),
+            output_field=FloatField()
+        )
+        all_time_changed = MovieRanking.objects.filter(
+            ~Q(all_time_score=all_time)
+        ).update(all_time_score=all_time)
+
+        # Only rankings that were or now are trending need writing
+        scores = trending_scores(now)
+        movie_ids = set(scores) | set(
+            MovieRanking.objects.filter(trending_score__gt=0)
+            .values_list('movie_id', flat=True)
+        )
+        MovieRanking.objects.bulk_update(
+            [
+                MovieRanking(
+                    movie_id=movie_id, trending_score=scores.get(movie_id, 0)
+                )
+                for movie_id in movie_ids
+            ],
+            ['trending_score'],
+            batch_size=BATCH_SIZE
+        )
+    return all_time_changed, len(movie_ids)
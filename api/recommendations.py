@@ -0,0 +1,338 @@
+import numpy as np
+from scipy import sparse
+from .models import (
+    Comment,
+    FollowSuggestion,
+    Like,
+    Movie,
+    MovieCast,
+    MovieGenre,
+    MovieSimilarity,
+    UserProfile
+)
+
+
+# Offline recommenders built on sparse matrices.
+# Only the management commands import this module, so the web process
+# never loads NumPy and SciPy.
+CHUNK_SIZE = 10000
+BATCH_SIZE = 5000
+# Share of each signal in the similarity of two movies
+GENRE_WEIGHT = 1.0
+CAST_WEIGHT = 1.0
+CO_LIKE_WEIGHT = 2.0
+# A movie's similar movies are rebuilt once its likes_count moved by at
+# least this many likes and this share of the count they were built with
+SIMILARITY_MIN_LIKE_CHANGE = 5
+SIMILARITY_LIKE_CHANGE_RATIO = 0.2
+
+
+def fetch_pairs(queryset, fields):
+    # Two int64 arrays from a two column values_list, streamed in chunks
+    values = np.fromiter(
+        (
+            value
+            for row in queryset.values_list(*fields).order_by()
+            .iterator(chunk_size=CHUNK_SIZE)
+            for value in row
+        ),
+        dtype=np.int64
+    )
+    return values[0::2], values[1::2]
+
+
+def normalize_rows(matrix):
+    # Scales every row to unit length so row dot products are cosines
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)))
+    norms[norms == 0] = 1
+    return sparse.diags((1 / norms.ravel()).astype(np.float32)) @ matrix
+
+
+def top_k(scores, k):
+    # Column indices and values of the k best scores in each row, best
+    # first, without sorting whole rows
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        best = np.tile(np.arange(k), (scores.shape[0], 1))
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    return (
+        np.take_along_axis(best, order, axis=1),
+        np.take_along_axis(best_scores, order, axis=1)
+    )
+
+
+def follow_pairs():
+    # (follower user id, followed user id) for every follow.
+    # followers edges point from the followed profile to the follower.
+    return fetch_pairs(
+        UserProfile.followers.through.objects,
+        ('to_userprofile__user_id', 'from_userprofile__user_id')
+    )
+
+
+def user_item_matrix():
+    # One row per user and one column per movie, comment and followed
+    # account they interacted with. Rare items weigh more than popular
+    # ones (idf), and rows are unit length.
+    movie_likes = Like.objects.filter(
+        content_type=Movie.get_default_like_content_type()
+    )
+    comment_likes = Like.objects.filter(
+        content_type=Comment.get_default_like_content_type()
+    )
+    follower_ids, followed_ids = follow_pairs()
+    groups = [
+        (
+            fetch_pairs(movie_likes, ('user_id', 'object_id')),
+            fetch_pairs(Comment.objects, ('user_id', 'movie_id')),
+        ),
+        (fetch_pairs(comment_likes, ('user_id', 'object_id')),),
+        ((follower_ids, followed_ids),),
+    ]
+
+    users, items = [], []
+    offset = 0
+    for pairs in groups:
+        group_users = np.concatenate([user for user, item in pairs])
+        group_items = np.concatenate([item for user, item in pairs])
+        unique_items, columns = np.unique(group_items, return_inverse=True)
+        users.append(group_users)
+        items.append(columns + offset)
+        offset += len(unique_items)
+
+    user_ids, rows = np.unique(np.concatenate(users), return_inverse=True)
+    columns = np.concatenate(items)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, columns)),
+        shape=(len(user_ids), offset)
+    )
+    # Repeated interactions with the same item count once
+    matrix.data[:] = 1
+
+    document_frequency = np.asarray(matrix.getnnz(axis=0), dtype=np.float32)
+    idf = np.log1p(len(user_ids) / np.maximum(document_frequency, 1))
+    matrix = normalize_rows(matrix @ sparse.diags(idf.astype(np.float32)))
+    return user_ids, matrix.tocsr(), (follower_ids, followed_ids)
+
+
+def index_of(sorted_ids, ids):
+    # Positions of ids in the sorted array sorted_ids, -1 when missing
+    if not len(sorted_ids):
+        return np.full(len(ids), -1)
+    positions = np.searchsorted(sorted_ids, ids)
+    positions[positions >= len(sorted_ids)] = 0
+    return np.where(sorted_ids[positions] == ids, positions, -1)
+
+
+def follow_suggestions(top=20, block_size=256):
+    # Yields FollowSuggestion rows, a block of users at a time.
+    # Each block is one sparse x sparse product of the block's rows against
+    # every user, only made dense as the block_size x users score matrix,
+    # so memory stays bounded whatever the number of users and items.
+    user_ids, matrix, (follower_ids, followed_ids) = user_item_matrix()
+    total = len(user_ids)
+    if total < 2:
+        return
+
+    followers = index_of(user_ids, follower_ids)
+    followed = index_of(user_ids, followed_ids)
+    known = (followers >= 0) & (followed >= 0)
+    follows = sparse.csr_matrix(
+        (
+            np.ones(known.sum(), dtype=bool),
+            (followers[known], followed[known])
+        ),
+        shape=(total, total)
+    )
+
+    transposed = matrix.T.tocsr()
+    for start in range(0, total, block_size):
+        stop = min(start + block_size, total)
+        scores = (matrix[start:stop] @ transposed).toarray()
+        # Never suggest yourself or someone you already follow
+        scores[np.arange(stop - start), np.arange(start, stop)] = 0
+        scores[follows[start:stop].nonzero()] = 0
+
+        best, best_scores = top_k(scores, top)
+        block_rows, ranks = np.nonzero(best_scores > 0)
+        for row, rank in zip(block_rows.tolist(), ranks.tolist()):
+            yield FollowSuggestion(
+                user_id=int(user_ids[start + row]),
+                suggested_id=int(user_ids[best[row, rank]]),
+                score=float(best_scores[row, rank]),
+                rank=rank + 1
+            )
+
+
+def rebuild_follow_suggestions(top=20, block_size=256):
+    # Replaces every stored suggestion, returns how many were written
+    FollowSuggestion.objects.all().delete()
+    batch, total = [], 0
+    for suggestion in follow_suggestions(top, block_size):
+        batch.append(suggestion)
+        if len(batch) >= BATCH_SIZE:
+            FollowSuggestion.objects.bulk_create(batch)
+            total += len(batch)
+            batch = []
+    FollowSuggestion.objects.bulk_create(batch)
+    return total + len(batch)
+
+
+def weighted_parts(parts):
+    # Scales each (matrix, weight) part to rows of length sqrt(weight),
+    # then the parts together to unit length, so a row dot product is the
+    # weighted mean of the parts' cosines over the parts both rows have
+    parts = [(normalize_rows(matrix), weight) for matrix, weight in parts]
+    squares = sum(
+        weight * (np.asarray(matrix.getnnz(axis=1)) > 0)
+        for matrix, weight in parts
+    )
+    scale = 1 / np.sqrt(np.maximum(squares, 1e-12)).astype(np.float32)
+    return [
+        sparse.diags(scale * np.float32(np.sqrt(weight))) @ matrix
+        for matrix, weight in parts
+    ]
+
+
+def movie_features():
+    # Movie ids, their likes_count and similarity_likes_count (NaN when
+    # never built), a dense genre matrix and a sparse cast and co-like
+    # matrix, one row per catalog movie
+    ids, likes, built = [], [], []
+    movies = (
+        Movie.objects
+        .exclude(thumbnail__isnull=True)
+        .exclude(thumbnail='')
+        .order_by('id')
+        .values_list('id', 'likes_count', 'similarity_likes_count')
+    )
+    for movie_id, likes_count, built_count in movies.iterator(
+        chunk_size=CHUNK_SIZE
+    ):
+        ids.append(movie_id)
+        likes.append(likes_count)
+        built.append(np.nan if built_count is None else built_count)
+    movie_ids = np.array(ids, dtype=np.int64)
+    total = len(movie_ids)
+
+    def matrix(rows, columns):
+        # Sparse 0/1 rows x columns with idf weighted columns
+        _, columns = np.unique(columns, return_inverse=True)
+        result = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, columns)),
+            shape=(total, columns.max() + 1 if len(columns) else 0)
+        )
+        result.data[:] = 1
+        document_frequency = result.getnnz(axis=0)
+        idf = np.log1p(total / np.maximum(document_frequency, 1))
+        return result @ sparse.diags(idf.astype(np.float32))
+
+    def catalog_pairs(queryset, fields):
+        movie_rows, columns = fetch_pairs(queryset, fields)
+        movie_rows = index_of(movie_ids, movie_rows)
+        known = movie_rows >= 0
+        return movie_rows[known], columns[known]
+
+    genre_rows, genre_ids = catalog_pairs(
+        MovieGenre.objects, ('movie_id', 'genre_id')
+    )
+    cast_rows, person_ids = catalog_pairs(
+        MovieCast.objects, ('movie_id', 'person_id')
+    )
+    like_rows, like_users = catalog_pairs(
+        Like.objects.filter(
+            content_type=Movie.get_default_like_content_type()
+        ),
+        ('object_id', 'user_id')
+    )
+    genres, cast, co_likes = weighted_parts([
+        (matrix(genre_rows, genre_ids), GENRE_WEIGHT),
+        (matrix(cast_rows, person_ids), CAST_WEIGHT),
+        (matrix(like_rows, like_users), CO_LIKE_WEIGHT),
+    ])
+    # Few genres are shared by many movies, so their products are cheapest
+    # as dense BLAS; cast members and fans are shared by few movies
+    return (
+        movie_ids,
+        np.array(likes, dtype=np.float32),
+        np.array(built, dtype=np.float32),
+        genres.toarray(),
+        sparse.hstack([cast, co_likes]).tocsr()
+    )
+
+
+def stale_rows(likes, built):
+    # Rows never built, or whose likes moved enough since they were
+    change = np.abs(likes - built)
+    return np.flatnonzero(np.isnan(built) | (
+        (change >= SIMILARITY_MIN_LIKE_CHANGE) &
+        (change >= SIMILARITY_LIKE_CHANGE_RATIO * built)
+    ))
+
+
+def similar_movies(movie_ids, genres, matrix, rows, top=20, block_size=256):
+    # Yields MovieSimilarity rows for the movies at positions rows, scored
+    # against the whole catalog a block of movies at a time
+    others = matrix.T.tocsr()
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        scores = genres[block] @ genres.T
+        scores += (matrix[block] @ others).toarray()
+        # A movie is not similar to itself
+        scores[np.arange(len(block)), block] = 0
+
+        best, best_scores = top_k(scores, top)
+        block_rows, ranks = np.nonzero(best_scores > 0)
+        for row, rank in zip(block_rows.tolist(), ranks.tolist()):
+            yield MovieSimilarity(
+                movie_id=int(movie_ids[block[row]]),
+                similar_id=int(movie_ids[best[row, rank]]),
+                score=float(best_scores[row, rank]),
+                rank=rank + 1
+            )
+
+
+def build_similar_movies(top=20, block_size=256, full=False):
+    # Rebuilds the similar movies of every catalog movie with full, else
+    # only of the movies that are new or whose likes changed substantially.
+    # Returns how many movies were rebuilt and how many rows written.
+    movie_ids, likes, built, genres, matrix = movie_features()
+    if full:
+        rows = np.arange(len(movie_ids))
+        MovieSimilarity.objects.all().delete()
+    else:
+        rows = stale_rows(likes, built)
+        for start in range(0, len(rows), BATCH_SIZE):
+            MovieSimilarity.objects.filter(
+                movie_id__in=movie_ids[rows[start:start + BATCH_SIZE]]
+                .tolist()
+            ).delete()
+
+    batch, total = [], 0
+    for similarity in similar_movies(
+        movie_ids, genres, matrix, rows, top, block_size
+    ):
+        batch.append(similarity)
+        if len(batch) >= BATCH_SIZE:
+            MovieSimilarity.objects.bulk_create(batch)
+            total += len(batch)
+            batch = []
+    MovieSimilarity.objects.bulk_create(batch)
+    total += len(batch)
+
+    # Remember the likes each movie was built with, as read above
+    Movie.objects.bulk_update(
+        [
+            Movie(
+                pk=int(movie_ids[row]),
+                similarity_likes_count=int(likes[row])
+            )
+            for row in rows
+        ],
+        ['similarity_likes_count'],
+        batch_size=BATCH_SIZE
+    )
+    return len(rows), total
@@ -0,0 +1,35 @@
+import random
+from django.core.cache import cache
+from .cache import cache_timeout, get_cache_version
+
+
+# Random movie picks without ORDER BY RANDOM() or OFFSET n.
+# The ids a request can pick from are cached as a plain list per filter
+# combination and per 'movies' version, so any movie change rebuilds them.
+# Picking is done in memory and the movies are fetched by primary key
+# through the request's queryset.
+ID_POOL_TIMEOUT = 60 * 60
+MAX_SAMPLE_SIZE = 24
+
+
+def id_pool(queryset, pool_key=None):
+    # pool_key=None skips the cache, for filters too varied to be worth it
+    if pool_key is None:
+        return list(queryset.values_list('id', flat=True))
+    key = f"movies:random:{get_cache_version('movies')}:{pool_key}"
+    ids = cache.get(key)
+    if ids is None:
+        ids = list(queryset.order_by().values_list('id', flat=True))
+        cache.set(key, ids, cache_timeout(ID_POOL_TIMEOUT))
+    return ids
+
+
+def sample(queryset, n=1, pool_key=None):
+    ids = id_pool(queryset, pool_key)
+    picked = random.sample(ids, min(n, len(ids)))
+    # Fetched through queryset so its annotations (is_liked_by_user) stay
+    movies = {
+        movie.pk: movie
+        for movie in queryset.order_by().filter(pk__in=picked)
+    }
+    return [movies[pk] for pk in picked if pk in movies]
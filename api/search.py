@@ -0,0 +1,167 @@
+import re
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+
+# Full-text search over Movie.title and Movie.extract.
+# Postgres keeps a generated, GIN-indexed tsvector column on api_movie;
+# SQLite keeps an FTS5 table that triggers update as movies change.
+# Both rank matches and treat every search term as a prefix.
+MOVIE_TABLE = 'api_movie'
+FTS_TABLE = 'api_movie_fts'
+SEARCH_CONFIG = 'english'
+MAX_TERMS = 16
+
+POSTGRES_INSTALL = [
+    f"""
+    ALTER TABLE {MOVIE_TABLE} ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(extract, '')), 'B')
+    ) STORED
+    """,
+    f"""
+    CREATE INDEX IF NOT EXISTS {MOVIE_TABLE}_search_vector_idx
+    ON {MOVIE_TABLE} USING gin (search_vector)
+    """,
+]
+
+POSTGRES_UNINSTALL = [
+    f"DROP INDEX IF EXISTS {MOVIE_TABLE}_search_vector_idx",
+    f"ALTER TABLE {MOVIE_TABLE} DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_TABLE = f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, extract,
+        content='{MOVIE_TABLE}', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+"""
+
+SQLITE_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai
+    AFTER INSERT ON {MOVIE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, extract)
+        VALUES (new.id, new.title, new.extract);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad
+    AFTER DELETE ON {MOVIE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, extract)
+        VALUES ('delete', old.id, old.title, old.extract);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF title, extract ON {MOVIE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, extract)
+        VALUES ('delete', old.id, old.title, old.extract);
+        INSERT INTO {FTS_TABLE}(rowid, title, extract)
+        VALUES (new.id, new.title, new.extract);
+    END
+    """,
+]
+
+SQLITE_REBUILD = f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+
+SQLITE_UNINSTALL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def install_search_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for sql in POSTGRES_INSTALL:
+                cursor.execute(sql)
+        elif connection.vendor == 'sqlite':
+            cursor.execute(SQLITE_TABLE)
+            for sql in SQLITE_TRIGGERS:
+                cursor.execute(sql)
+            cursor.execute(SQLITE_REBUILD)
+
+
+def uninstall_search_index(connection):
+    statements = {
+        'postgresql': POSTGRES_UNINSTALL,
+        'sqlite': SQLITE_UNINSTALL,
+    }.get(connection.vendor, [])
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def ensure_search_index(sender, using='default', **kwargs):
+    # SQLite drops triggers whenever a migration remakes api_movie,
+    # so put them back (and resync the index) after every migrate
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')"
+            " AND name LIKE %s",
+            [f'{FTS_TABLE}%']
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+    expected = {FTS_TABLE, f'{FTS_TABLE}_ai', f'{FTS_TABLE}_ad',
+                f'{FTS_TABLE}_au'}
+    if FTS_TABLE in existing and not expected <= existing:
+        install_search_index(connection)
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+# Filters a Movie queryset down to matches for query and orders them by
+# the annotated `search_rank` (higher is better)
+def search_movies(queryset, query):
+    terms = search_terms(query)
+    if not terms:
+        return queryset
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        matches = RawSQL(
+            f"{MOVIE_TABLE}.search_vector @@ "
+            f"to_tsquery('{SEARCH_CONFIG}', %s)",
+            (tsquery,),
+            output_field=BooleanField()
+        )
+        rank = RawSQL(
+            f"ts_rank({MOVIE_TABLE}.search_vector, "
+            f"to_tsquery('{SEARCH_CONFIG}', %s))",
+            (tsquery,),
+            output_field=FloatField()
+        )
+        queryset = queryset.filter(matches)
+    elif vendor == 'sqlite':
+        # Quoted so FTS5 never parses user input as query syntax
+        match = ' '.join(f'"{term}"*' for term in terms)
+        queryset = queryset.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+            (match,)
+        ))
+        # bm25 is lower-is-better; title matches weigh 10x the extract
+        rank = RawSQL(
+            f"SELECT -bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid = {MOVIE_TABLE}.id",
+            (match,),
+            output_field=FloatField()
+        )
+    else:
+        return queryset.filter(
+            Q(title__icontains=query) | Q(extract__icontains=query)
+        )
+
+    return queryset.annotate(search_rank=rank).order_by('-search_rank', 'id')
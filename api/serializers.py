@@ -21,9 +21,20 @@ User = get_user_model()
 logger = logging.getLogger('zaptalk_api.api')
 
 
+def get_like_state(serializer, obj):
+    # Uses the with_like_state annotation when the queryset has it
+    if hasattr(obj, 'is_liked_by_user'):
+        return obj.is_liked_by_user
+    request = serializer.context.get('request')
+    if request and request.user.is_authenticated:
+        return obj.likes.filter(user=request.user).exists()
+    return False
+
+
 class MovieSerializer(serializers.ModelSerializer):
     likes_count = serializers.IntegerField(read_only=True)
     comments_count = serializers.IntegerField(read_only=True)
+    is_liked_by_user = serializers.SerializerMethodField()
 
     class Meta:
         model = Movie
@@ -39,9 +50,13 @@ class MovieSerializer(serializers.ModelSerializer):
             'thumbnail_width',
             'thumbnail_height',
             'likes_count',
-            'comments_count'
+            'comments_count',
+            'is_liked_by_user'
         ]
 
+    def get_is_liked_by_user(self, obj):
+        return get_like_state(self, obj)
+
     def get_likes_count(self, obj):
         return obj.likes_count
 
@@ -94,28 +109,43 @@ class UserProfileSerializer(serializers.ModelSerializer):
             'is_banned'
         ]
 
+    # The get_* methods below prefer the annotations added by
+    # UserProfile.objects.with_stats() and fall back to a query each
+
     def get_comment_count(self, obj):
+        if hasattr(obj, 'comment_count'):
+            return obj.comment_count
         return obj.get_comment_count()
 
     def get_total_likes_received(self, obj):
+        if hasattr(obj, 'total_likes_received'):
+            return obj.total_likes_received
         return obj.get_total_likes_received()
 
     def get_followers_count(self, obj):
+        if hasattr(obj, 'followers_count'):
+            return obj.followers_count
         return obj.get_followers_count()
 
     def get_following_count(self, obj):
+        if hasattr(obj, 'following_count'):
+            return obj.following_count
         return obj.get_following_count()
 
     def get_is_following(self, obj):
+        if hasattr(obj, 'viewer_is_following'):
+            return obj.viewer_is_following
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return request.user.profile in obj.followers.all()
+            return obj.followers.filter(user=request.user).exists()
         return False
 
     def get_is_superuser(self, obj):
         return obj.user.is_superuser
 
     def get_is_banned(self, obj):
+        if hasattr(obj, 'banned'):
+            return obj.banned
         return obj.is_banned()
 
     def update(self, instance, validated_data):
@@ -174,65 +204,68 @@ class LikeSerializer(serializers.ModelSerializer):
             )
         }
 
-    # Gets content type
-    def get_content_type(self, obj):
-        if obj.content_type == Movie.get_default_like_content_type():
+    # 'movie' or 'comment', read from the ContentType cache
+    # so no query is needed per like
+    def like_kind(self, obj):
+        if obj.content_type_id == Movie.get_default_like_content_type().id:
             return 'movie'
-        elif obj.content_type == Comment.get_default_like_content_type():
+        elif (
+            obj.content_type_id ==
+            Comment.get_default_like_content_type().id
+        ):
             return 'comment'
         return None
 
+    # The liked movie, or the movie of the liked comment.
+    # Use utils.prefetch_like_targets to load these for a whole page
+    def liked_movie(self, obj):
+        kind = self.like_kind(obj)
+        target = obj.content_object if kind else None
+        if target is None:
+            return None
+        return target if kind == 'movie' else target.movie
+
+    # Gets content type
+    def get_content_type(self, obj):
+        return self.like_kind(obj)
+
     # Get likes on either movie or comment
     def get_content_object(self, obj):
-        if obj.content_type == Movie.get_default_like_content_type():
-            movie = obj.content_object
+        kind = self.like_kind(obj)
+        target = obj.content_object if kind else None
+        if target is None:
+            return None
+        if kind == 'movie':
             return {
-                'id': movie.id,
-                'title': movie.title,
+                'id': target.id,
+                'title': target.title,
                 'type': 'movie'
             }
-        elif obj.content_type == Comment.get_default_like_content_type():
-            comment = obj.content_object
-            return {
-                'id': comment.id,
-                'content': (
-                    comment.content[:50] + '...'
-                    if len(comment.content) > 50
-                    else comment.content
-                ),
-                'type': 'comment',
-                'movie_id': comment.movie.id if comment.movie else None
-            }
-        return None
+        return {
+            'id': target.id,
+            'content': (
+                target.content[:50] + '...'
+                if len(target.content) > 50
+                else target.content
+            ),
+            'type': 'comment',
+            'movie_id': target.movie_id
+        }
 
     # This is used for the feed page
     # To get a like or a comment "Sandra Commented on x"
     def get_type(self, obj):
-        if obj.content_type == Movie.get_default_like_content_type():
+        kind = self.like_kind(obj)
+        if kind == 'movie':
             return 'like'
-        elif obj.content_type == Comment.get_default_like_content_type():
-            return 'comment'
-        return None
+        return kind
 
     def get_movie_title(self, obj):
-        if obj.content_type == Movie.get_default_like_content_type():
-            return obj.content_object.title
-        elif obj.content_type == Comment.get_default_like_content_type():
-            return (
-                obj.content_object.movie.title
-                if obj.content_object.movie
-                else None
-            )
-        return None
+        movie = self.liked_movie(obj)
+        return movie.title if movie else None
 
     def get_movie_details(self, obj):
-        if obj.content_type == Movie.get_default_like_content_type():
-            movie = obj.content_object
-        elif obj.content_type == Comment.get_default_like_content_type():
-            movie = obj.content_object.movie
-        else:
-            return None
-
+        movie = self.liked_movie(obj)
         if movie:
             return {
                 'id': movie.id,
@@ -248,7 +281,7 @@ class LikeSerializer(serializers.ModelSerializer):
 
 class CommentSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
-    likes_count = serializers.SerializerMethodField()
+    likes_count = serializers.IntegerField(read_only=True)
     is_liked_by_user = serializers.SerializerMethodField()
     movie_details = serializers.SerializerMethodField()
 
@@ -273,14 +306,8 @@ class CommentSerializer(serializers.ModelSerializer):
             'is_liked_by_user'
         ]
 
-    def get_likes_count(self, obj):
-        return obj.likes.count()
-
     def get_is_liked_by_user(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return obj.likes.filter(user=request.user).exists()
-        return False
+        return get_like_state(self, obj)
 
     def get_movie_details(self, obj):
         if obj.movie:
@@ -431,6 +458,8 @@ class NotificationSerializer(serializers.ModelSerializer):
             'sender_username',
             'sender_avatar',
             'notification_type',
+            'object_id',
+            'others_count',
             'is_read',
             'created_at'
         ]
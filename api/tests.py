@@ -1,3 +1,534 @@
-from django.test import TestCase
+import asyncio
+import base64
+import io
+import json
+import os
+import tempfile
+from django.contrib.auth.models import User
+from django.core.cache.backends.base import memcache_key_warnings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from .cache import cache_timeout
+from .management.commands.import_movies import iter_json_array
+from .models import (
+    Comment, Like, Movie, Notification, TimelineEntry, UserProfile
+)
+from .notifications import enqueue, mark_read, process_outbox, prune_events
+from .timeline import read_on_users
+from .events import InProcessBroker
+from .views import movie_list_cache_key, server_sent_events
 
-# Create your tests here.
+
+class CommentListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', password='pw')
+        authors = [
+            User.objects.create_user(f'author{i}', password='pw')
+            for i in range(5)
+        ]
+        movies = [
+            Movie.objects.create(title=f'Movie {i}', year=2000 + i)
+            for i in range(3)
+        ]
+        comments = [
+            Comment.objects.create(
+                user=authors[i % len(authors)],
+                movie=movies[i % len(movies)],
+                content=f'Comment {i}'
+            )
+            for i in range(30)
+        ]
+        for comment in comments[::3]:
+            Like.objects.create(
+                user=cls.viewer,
+                content_type=Comment.get_default_like_content_type(),
+                object_id=comment.pk
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+        # The content type lookup is cached after the first use
+        Comment.get_default_like_content_type()
+
+    def test_page_query_count_does_not_grow_with_page_size(self):
+        # One COUNT and one SELECT, whatever the page size
+        for page_size in (1, 10, 30):
+            with self.assertNumQueries(2):
+                response = self.client.get(
+                    '/api/comments/', {'page_size': page_size}
+                )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), page_size)
+
+    def test_keyset_page_is_a_single_query(self):
+        for page_size in (1, 30):
+            with self.assertNumQueries(1):
+                response = self.client.get(
+                    '/api/comments/', {'cursor': '', 'page_size': page_size}
+                )
+            self.assertEqual(len(response.data['results']), page_size)
+
+    def test_page_contents(self):
+        response = self.client.get('/api/comments/', {'page_size': 30})
+        results = response.data['results']
+        liked = [item['id'] for item in results if item['is_liked_by_user']]
+        self.assertEqual(len(liked), 10)
+        self.assertEqual(
+            [item['id'] for item in results],
+            list(
+                Comment.objects.order_by('-created_at', '-id')
+                .values_list('id', flat=True)
+            )
+        )
+        first = results[0]
+        comment = Comment.objects.get(pk=first['id'])
+        self.assertEqual(first['user']['username'], comment.user.username)
+        self.assertEqual(first['movie_details']['title'], comment.movie.title)
+        self.assertEqual(first['likes_count'], comment.likes_count)
+
+
+@override_settings(TIMELINE_FANOUT=True, TIMELINE_FANOUT_MAX_FOLLOWERS=2)
+class FanOutFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', password='pw')
+        cls.celebrity = User.objects.create_user('celebrity', password='pw')
+        cls.author = User.objects.create_user('author', password='pw')
+        fans = [
+            User.objects.create_user(f'fan{i}', password='pw')
+            for i in range(2)
+        ]
+        # Three followers puts the celebrity over the fan-out limit
+        for user in [cls.viewer] + fans:
+            user.profile.follow(cls.celebrity.profile)
+        cls.viewer.profile.follow(cls.author.profile)
+
+        movie = Movie.objects.create(title='Movie', year=2000)
+        for i in range(10):
+            for user in (cls.celebrity, cls.author):
+                Comment.objects.create(
+                    user=user, movie=movie, content=f'Comment {i}'
+                )
+
+    def test_only_authors_over_the_limit_are_read_on_demand(self):
+        self.assertEqual(
+            read_on_users(self.viewer.profile), [self.celebrity.id]
+        )
+        self.assertFalse(
+            TimelineEntry.objects.filter(actor=self.celebrity).exists()
+        )
+        self.assertEqual(
+            TimelineEntry.objects.filter(
+                owner=self.viewer, actor=self.author
+            ).count(),
+            10
+        )
+
+    def test_feed_merges_fanned_out_and_read_on_demand_items(self):
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        response = client.get('/api/profiles/feed/', {'page_size': 50})
+        authors = [
+            item['user']['username'] for item in response.data['results']
+        ]
+        self.assertEqual(len(authors), 20)
+        self.assertEqual(authors.count('celebrity'), 10)
+        self.assertEqual(authors.count('author'), 10)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader', password='pw')
+        movie = Movie.objects.create(title='Movie', year=2000)
+        cls.comments = [
+            Comment.objects.create(
+                user=cls.user, movie=movie, content=f'Comment {i}'
+            )
+            for i in range(7)
+        ]
+        # Ties on created_at must still be paged through by id
+        Comment.objects.filter(
+            pk__in=[comment.pk for comment in cls.comments[2:5]]
+        ).update(created_at=cls.comments[2].created_at)
+        for i in range(5):
+            Movie.objects.create(title=f'Other {i}', year=2001)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def follow_pages(self, url, params):
+        ids, pages = [], 0
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            pages += 1
+            if not response.data['next']:
+                return ids, pages
+            response = self.client.get(response.data['next'])
+
+    def test_empty_cursor_is_the_first_page(self):
+        response = self.client.get(
+            '/api/comments/', {'cursor': '', 'page_size': 3}
+        )
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            list(
+                Comment.objects.order_by('-created_at', '-id')
+                .values_list('id', flat=True)[:3]
+            )
+        )
+        self.assertIn('cursor=', response.data['next'])
+
+    def test_next_links_visit_every_row_once_in_order(self):
+        ids, pages = self.follow_pages(
+            '/api/comments/', {'cursor': '', 'page_size': 2}
+        )
+        self.assertEqual(pages, 4)
+        self.assertEqual(
+            ids,
+            list(
+                Comment.objects.order_by('-created_at', '-id')
+                .values_list('id', flat=True)
+            )
+        )
+
+    def test_next_link_is_stable_when_rows_are_added(self):
+        first = self.client.get(
+            '/api/comments/', {'cursor': '', 'page_size': 3}
+        )
+        Comment.objects.create(
+            user=self.user, movie=self.comments[0].movie, content='New'
+        )
+        second = self.client.get(first.data['next'])
+        expected = list(
+            Comment.objects.filter(
+                pk__in=[comment.pk for comment in self.comments]
+            )
+            .order_by('-created_at', '-id')
+            .values_list('id', flat=True)[3:6]
+        )
+        self.assertEqual(
+            [item['id'] for item in second.data['results']], expected
+        )
+
+    def test_movie_keyset_pages(self):
+        ids, _ = self.follow_pages(
+            '/api/movies/', {'cursor': '', 'page_size': 2}
+        )
+        self.assertEqual(
+            ids,
+            list(Movie.objects.order_by('id').values_list('id', flat=True))
+        )
+
+    def test_invalid_cursors_are_not_found(self):
+        cursors = {
+            '/api/movies/': [
+                'not base64!', encode_cursor(['abc']), encode_cursor([1, 2]),
+                encode_cursor({'id': 1}), encode_cursor([None]),
+                encode_cursor([[1]]),
+            ],
+            '/api/comments/': [
+                encode_cursor(['yesterday', 1]),
+                encode_cursor(['2024-01-01T00:00:00+00:00', 'abc']),
+            ],
+        }
+        for url, values in cursors.items():
+            for cursor in values:
+                with self.subTest(url=url, cursor=cursor):
+                    response = self.client.get(url, {'cursor': cursor})
+                    self.assertEqual(response.status_code, 404)
+
+    def test_like_list_bad_page_or_cursor_is_not_found(self):
+        for params in ({'page': 99}, {'cursor': 'not base64!'}):
+            with self.subTest(params=params):
+                response = self.client.get('/api/likes/', params)
+                self.assertEqual(response.status_code, 404)
+
+
+class StreamingJsonReaderTests(TestCase):
+    def read(self, text, chunk_size=3):
+        return list(iter_json_array(io.StringIO(text), chunk_size))
+
+    def test_items_split_across_chunks(self):
+        items = [
+            {'title': 'A, "quoted" ] title', 'cast': ['x', 'y']},
+            {'nested': {'list': [1, [2, 3]], 'text': '[,]'}},
+            'plain', 42, None,
+        ]
+        text = json.dumps(items, indent=2)
+        for chunk_size in (1, 3, 7, 1 << 16):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.read(text, chunk_size), items)
+
+    def test_empty_array(self):
+        self.assertEqual(self.read(' [ ] '), [])
+
+    def test_malformed_input(self):
+        for text in ('{"title": "A"}', '', '[{"title": "A"},', '[{"a": }]'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    self.read(text)
+
+
+class ImportMoviesTests(TestCase):
+    def import_movies(self, records, *options):
+        with tempfile.NamedTemporaryFile(
+            'w', suffix='.json', delete=False
+        ) as file:
+            json.dump(records, file)
+        self.addCleanup(os.remove, file.name)
+        output = io.StringIO()
+        call_command(
+            'import_movies', file.name, '--batch-size', '2', *options,
+            stdout=output
+        )
+        return output.getvalue()
+
+    def test_import_in_batches_skips_invalid_records(self):
+        output = self.import_movies([
+            {'title': 'A', 'year': 1990, 'genres': ['Drama'],
+             'cast': ['Tom Hanks']},
+            {'title': 'B', 'year': 'not a year'},
+            {'title': 'C', 'year': 1991, 'genres': 'Drama'},
+            {'title': 'D', 'year': 1992, 'href': 'D_(film)'},
+            {'title': 'E', 'year': 1993},
+        ])
+        self.assertEqual(
+            list(Movie.objects.order_by('title').values_list('title', 'year')),
+            [('A', 1990), ('D', 1992), ('E', 1993)]
+        )
+        self.assertIn('3 created, 0 updated', output)
+        self.assertIn('errors while importing 2 movies', output)
+        movie = Movie.objects.get(title='A')
+        self.assertEqual(
+            list(movie.genre_tags.values_list('slug', flat=True)), ['drama']
+        )
+        self.assertEqual(
+            list(movie.cast_members.values_list('slug', flat=True)),
+            ['tom-hanks']
+        )
+
+    def test_upsert_updates_matching_movies(self):
+        self.import_movies([
+            {'title': 'A', 'year': 1990, 'href': 'A_(film)',
+             'genres': ['Drama']},
+            {'title': 'B', 'year': 1991},
+        ])
+        ids = dict(Movie.objects.values_list('title', 'id'))
+        output = self.import_movies([
+            # Matched on href, so the title can change
+            {'title': 'A renamed', 'year': 1990, 'href': 'A_(film)',
+             'genres': ['Comedy']},
+            {'title': 'B', 'year': 1992},
+            # Matched on title and year; the later record of a batch wins
+            {'title': 'B', 'year': 1991, 'extract': 'first'},
+            {'title': 'B', 'year': 1991, 'extract': 'second'},
+        ], '--upsert')
+        self.assertIn('1 created, 2 updated', output)
+        self.assertEqual(Movie.objects.count(), 3)
+        renamed = Movie.objects.get(pk=ids['A'])
+        self.assertEqual(renamed.title, 'A renamed')
+        self.assertEqual(
+            list(renamed.genre_tags.values_list('slug', flat=True)),
+            ['comedy']
+        )
+        self.assertEqual(Movie.objects.get(pk=ids['B']).extract, 'second')
+
+    def test_without_upsert_records_are_added(self):
+        self.import_movies([{'title': 'A', 'year': 1990}])
+        self.import_movies([{'title': 'A', 'year': 1990}])
+        self.assertEqual(Movie.objects.filter(title='A').count(), 2)
+
+
+@override_settings(NOTIFICATION_OUTBOX_SYNC=False)
+class NotificationOutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.fans = [
+            User.objects.create_user(f'fan{i}', password='pw')
+            for i in range(3)
+        ]
+
+    def unread(self):
+        return UserProfile.objects.get(
+            user=self.author
+        ).unread_notifications_count
+
+    def test_likes_on_one_comment_coalesce(self):
+        for fan in self.fans:
+            enqueue(self.author, fan, 'like', 1)
+        self.assertEqual(process_outbox(), 3)
+        notification = Notification.objects.get(recipient=self.author)
+        self.assertEqual(notification.sender, self.fans[-1])
+        self.assertEqual(notification.others_count, 2)
+        self.assertEqual(self.unread(), 1)
+
+    def test_repeated_sender_is_notified_once(self):
+        # Follow, unfollow, follow again within the window
+        enqueue(self.author, self.fans[0], 'follow')
+        process_outbox()
+        enqueue(self.author, self.fans[0], 'follow')
+        enqueue(self.author, self.fans[0], 'follow')
+        process_outbox()
+        notification = Notification.objects.get(recipient=self.author)
+        self.assertEqual(notification.others_count, 0)
+        self.assertEqual(self.unread(), 1)
+
+    def test_unread_notification_is_updated(self):
+        enqueue(self.author, self.fans[0], 'like', 1)
+        process_outbox()
+        enqueue(self.author, self.fans[1], 'like', 1)
+        enqueue(self.author, self.fans[2], 'like', 1)
+        process_outbox()
+        notification = Notification.objects.get(recipient=self.author)
+        self.assertEqual(notification.sender, self.fans[2])
+        self.assertEqual(notification.others_count, 2)
+        self.assertEqual(self.unread(), 1)
+
+    def test_read_notification_is_not_updated(self):
+        enqueue(self.author, self.fans[0], 'like', 1)
+        process_outbox()
+        mark_read(Notification.objects.filter(recipient=self.author))
+        enqueue(self.author, self.fans[1], 'like', 1)
+        process_outbox()
+        self.assertEqual(
+            list(Notification.objects.filter(
+                recipient=self.author, is_read=False
+            ).values_list('sender', 'others_count')),
+            [(self.fans[1].pk, 0)]
+        )
+        self.assertEqual(self.unread(), 1)
+
+    def test_different_objects_and_types_stay_apart(self):
+        enqueue(self.author, self.fans[0], 'like', 1)
+        enqueue(self.author, self.fans[1], 'like', 2)
+        enqueue(self.author, self.fans[0], 'follow')
+        process_outbox()
+        self.assertEqual(
+            Notification.objects.filter(recipient=self.author).count(), 3
+        )
+        self.assertEqual(self.unread(), 3)
+
+    def test_sender_is_notified_again_after_the_window(self):
+        enqueue(self.author, self.fans[0], 'like', 1)
+        process_outbox()
+        enqueue(self.author, self.fans[0], 'like', 1)
+        with override_settings(NOTIFICATION_COALESCE_WINDOW=0):
+            process_outbox()
+            # Processed events older than the window are dropped
+            self.assertEqual(prune_events(), 2)
+        self.assertEqual(
+            Notification.objects.filter(recipient=self.author).count(), 2
+        )
+
+    def test_unread_count_etag_follows_the_counter(self):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        first = client.get('/api/notifications/unread_count/')
+        self.assertEqual(first.data, {'unread_count': 0})
+        # Written by the worker, in another process
+        enqueue(self.author, self.fans[0], 'follow')
+        process_outbox()
+        second = client.get(
+            '/api/notifications/unread_count/',
+            HTTP_IF_NONE_MATCH=first['ETag']
+        )
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, {'unread_count': 1})
+        third = client.get(
+            '/api/notifications/unread_count/',
+            HTTP_IF_NONE_MATCH=second['ETag']
+        )
+        self.assertEqual(third.status_code, 304)
+
+
+class CacheTimeoutTests(TestCase):
+    def test_memory_cache_entries_expire_quickly(self):
+        # Other processes never see version bumps in a local memory cache
+        for timeout, expected in ((60 * 60 * 24, 60), (None, 60), (30, 30)):
+            with self.subTest(timeout=timeout):
+                self.assertEqual(cache_timeout(timeout), expected)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'zaptalk_cache',
+    }})
+    def test_shared_cache_keeps_timeouts(self):
+        for timeout in (60 * 60 * 24, None):
+            with self.subTest(timeout=timeout):
+                self.assertEqual(cache_timeout(timeout), timeout)
+
+
+class MovieListCacheKeyTests(TestCase):
+    def key(self, params):
+        request = APIRequestFactory().get('/api/movies/', params)
+        return movie_list_cache_key(Request(request))
+
+    def test_keys_are_safe_for_memcached(self):
+        for cast in ('tom hanks', 'a\x01b', 'x' * 1000):
+            with self.subTest(cast=cast):
+                key = self.key({'cast': cast})
+                self.assertEqual(list(memcache_key_warnings(key)), [])
+
+    def test_equivalent_filters_share_a_key(self):
+        self.assertEqual(
+            self.key({'cast': 'Tom Hanks, Meg Ryan', 'genres': 'Drama'}),
+            self.key({'cast': 'meg-ryan,tom-hanks', 'genres': 'drama'})
+        )
+        self.assertNotEqual(
+            self.key({'cast': 'tom-hanks'}), self.key({'cast': 'meg-ryan'})
+        )
+
+
+class ServerSentEventsTests(TestCase):
+    @override_settings(EVENT_STREAM_HEARTBEAT=0.1)
+    def test_events_sent_while_connecting_are_delivered(self):
+        async def first_event():
+            broker = InProcessBroker()
+            stream = server_sent_events(broker, 1)
+            try:
+                self.assertEqual(await stream.__anext__(), 'retry: 5000\n\n')
+                broker.publish({'users': [1]}, {'type': 'notification'})
+                return await stream.__anext__()
+            finally:
+                await stream.aclose()
+
+        self.assertEqual(
+            asyncio.run(first_event()),
+            'event: notification\ndata: {"type": "notification"}\n\n'
+        )
+
+
+class CommentCounterTests(TestCase):
+    def test_moving_a_comment_moves_its_count(self):
+        user = User.objects.create_user('writer', password='pw')
+        first = Movie.objects.create(title='First', year=2000)
+        second = Movie.objects.create(title='Second', year=2001)
+        comment = Comment.objects.create(
+            user=user, movie=first, content='Comment'
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.patch(
+            f'/api/comments/{comment.pk}/', {'movie': second.pk}
+        )
+        self.assertEqual(response.status_code, 200)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.comments_count, second.comments_count), (0, 1))
+        # Editing the content alone leaves the counts alone
+        client.patch(f'/api/comments/{comment.pk}/', {'content': 'Edited'})
+        second.refresh_from_db()
+        self.assertEqual(second.comments_count, 1)
@@ -0,0 +1,207 @@
+from django.conf import settings
+from django.db.models import Count, Exists, OuterRef, Q
+from .models import Comment, Like, TimelineEntry, UserProfile
+
+
+# Fan-out-on-write timelines.
+# With settings.TIMELINE_FANOUT on, every new comment or like is copied into
+# the TimelineEntry rows of each follower of its author, so reading a feed
+# page is a single indexed range read on (owner, created_at).
+# Authors with more than TIMELINE_FANOUT_MAX_FOLLOWERS followers are skipped
+# on write and their items are read from the source tables at read time.
+BATCH_SIZE = 1000
+
+
+def timeline_enabled():
+    return getattr(settings, 'TIMELINE_FANOUT', False)
+
+
+def max_followers():
+    return getattr(settings, 'TIMELINE_FANOUT_MAX_FOLLOWERS', 5000)
+
+
+def backfill_limit():
+    return getattr(settings, 'TIMELINE_BACKFILL_LIMIT', 200)
+
+
+def follower_edges(user_id):
+    # followers edges point from the followed profile to the follower
+    return UserProfile.followers.through.objects.filter(
+        from_userprofile__user_id=user_id
+    )
+
+
+def follower_user_ids(user_id):
+    return list(
+        follower_edges(user_id)
+        .values_list('to_userprofile__user_id', flat=True)
+    )
+
+
+def fans_out(user_id):
+    # Whether user_id's items are copied to followers on write. Reads at
+    # most max_followers() + 1 edges, never a celebrity's whole list.
+    return not follower_edges(user_id)[max_followers():].exists()
+
+
+def fan_out(actor_id, entry_type, object_id, created_at):
+    if not timeline_enabled() or not fans_out(actor_id):
+        return
+    owners = follower_user_ids(actor_id)
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(
+                owner_id=owner_id,
+                actor_id=actor_id,
+                entry_type=entry_type,
+                object_id=object_id,
+                created_at=created_at
+            )
+            for owner_id in owners
+        ],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def remove_entries(entry_type, object_id):
+    if timeline_enabled():
+        TimelineEntry.objects.filter(
+            entry_type=entry_type, object_id=object_id
+        ).delete()
+
+
+def recent_items(actor_id, limit):
+    # The newest comments and likes by actor_id as (type, id, created_at)
+    comments = (
+        Comment.objects.filter(user_id=actor_id)
+        .order_by('-created_at', '-id')
+        .values_list('id', 'created_at')[:limit]
+    )
+    likes = (
+        Like.objects.filter(user_id=actor_id)
+        .order_by('-created_at', '-id')
+        .values_list('id', 'created_at')[:limit]
+    )
+    return (
+        [('comment', pk, created_at) for pk, created_at in comments] +
+        [('like', pk, created_at) for pk, created_at in likes]
+    )
+
+
+def backfill(owner_id, actor_id, items=None):
+    if items is None:
+        items = recent_items(actor_id, backfill_limit())
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(
+                owner_id=owner_id,
+                actor_id=actor_id,
+                entry_type=entry_type,
+                object_id=object_id,
+                created_at=created_at
+            )
+            for entry_type, object_id, created_at in items
+        ],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def follow_changed(follower_profile_id, followed_profile_id, following):
+    if not timeline_enabled():
+        return
+    users = dict(
+        UserProfile.objects
+        .filter(pk__in=[follower_profile_id, followed_profile_id])
+        .values_list('pk', 'user_id')
+    )
+    owner_id = users[follower_profile_id]
+    actor_id = users[followed_profile_id]
+    if not following:
+        TimelineEntry.objects.filter(
+            owner_id=owner_id, actor_id=actor_id
+        ).delete()
+    elif fans_out(actor_id):
+        backfill(owner_id, actor_id)
+
+
+def read_on_users(profile):
+    # Users followed by profile whose items are not fanned out on write:
+    # those with a follower edge past the max_followers() first ones
+    follows = UserProfile.followers.through.objects
+    return list(
+        profile.following
+        .filter(Exists(
+            follows.filter(from_userprofile=OuterRef('pk'))
+            [max_followers():]
+        ))
+        .values_list('user_id', flat=True)
+    )
+
+
+def read_timeline(owner_id, cursor, page_size):
+    entries = TimelineEntry.objects.filter(owner_id=owner_id)
+    if cursor is not None:
+        created_at, entry_type, object_id = cursor
+        entries = entries.filter(
+            Q(created_at__lt=created_at) |
+            Q(created_at=created_at, entry_type__lt=entry_type) |
+            Q(
+                created_at=created_at,
+                entry_type=entry_type,
+                object_id__lt=object_id
+            )
+        )
+    rows = list(
+        entries.order_by('-created_at', '-entry_type', '-object_id')
+        [:page_size + 1]
+    )
+    for row in rows:
+        row.feed_type = row.entry_type
+        row.feed_id = row.object_id
+    return rows
+
+
+def resolve_entries(page):
+    # Swaps TimelineEntry rows for the comments and likes they point to
+    models = {'comment': Comment, 'like': Like}
+    wanted = {}
+    for item in page:
+        if isinstance(item, TimelineEntry):
+            wanted.setdefault(item.feed_type, set()).add(item.feed_id)
+    loaded = {
+        entry_type: models[entry_type].objects.in_bulk(ids)
+        for entry_type, ids in wanted.items()
+    }
+
+    items = []
+    for item in page:
+        if isinstance(item, TimelineEntry):
+            obj = loaded[item.feed_type].get(item.feed_id)
+            if obj is None:
+                continue
+            obj.feed_type = item.feed_type
+            obj.feed_id = obj.pk
+            item = obj
+        items.append(item)
+    return items
+
+
+def rebuild_timelines(stdout=None):
+    TimelineEntry.objects.all().delete()
+    actors = (
+        UserProfile.objects
+        .annotate(follower_total=Count('followers'))
+        .filter(follower_total__gt=0, follower_total__lte=max_followers())
+        .values_list('user_id', flat=True)
+    )
+    total = 0
+    for actor_id in actors.iterator(chunk_size=BATCH_SIZE):
+        items = recent_items(actor_id, backfill_limit())
+        if not items:
+            continue
+        for owner_id in follower_user_ids(actor_id):
+            backfill(owner_id, actor_id, items)
+            total += len(items)
+    return total
@@ -12,6 +12,8 @@ from .views import (
     BanViewSet,
     BanAppealViewSet,
     get_genres,
+    search_people,
+    event_stream,
     NotificationViewSet
 )
 
@@ -28,4 +30,6 @@ urlpatterns = [
     path('', include(router.urls)),
     # This is only a function view and why it's not in the router.register
     path('genres/', get_genres, name='get_genres'),
+    path('people/', search_people, name='search_people'),
+    path('events/', event_stream, name='event_stream'),
 ]
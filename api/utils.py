@@ -1,9 +1,45 @@
-from .models import Notification
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.contenttypes.prefetch import GenericPrefetch
+from django.db.models import QuerySet, prefetch_related_objects
+from .models import Movie, Comment, Like
+from .notifications import enqueue
 
 
-def create_notification(recipient, sender, notification_type):
-    Notification.objects.create(
-        recipient=recipient,
-        sender=sender,
-        notification_type=notification_type
-    )
+# Queues the notification in the outbox, see api/notifications.py
+def create_notification(recipient, sender, notification_type,
+                        object_id=None):
+    enqueue(recipient, sender, notification_type, object_id)
+
+
+# Loads what LikeSerializer needs for a batch of likes: the user with their
+# profile, and the liked movie or comment (with its movie). Likes are grouped
+# by content type so each kind of target costs one query.
+# Accepts a queryset (prefetched lazily) or a list of loaded likes.
+def prefetch_like_targets(likes):
+    targets = GenericPrefetch('content_object', [
+        Movie.objects.only('id', 'title', 'thumbnail'),
+        Comment.objects.select_related('movie').only(
+            'id', 'content', 'movie', 'movie__title', 'movie__thumbnail'
+        ),
+    ])
+    if isinstance(likes, QuerySet):
+        return likes.select_related('user__profile').prefetch_related(
+            targets
+        )
+    prefetch_related_objects(likes, 'user__profile', targets)
+    return likes
+
+
+# with_like_state for movies or comments that are already loaded:
+# one query for the whole list instead of one per serialized row
+def set_like_state(objects, user):
+    liked = set()
+    if objects and user.is_authenticated:
+        liked = set(Like.objects.filter(
+            user=user,
+            content_type=ContentType.objects.get_for_model(objects[0]),
+            object_id__in=[obj.pk for obj in objects]
+        ).values_list('object_id', flat=True))
+    for obj in objects:
+        obj.is_liked_by_user = obj.pk in liked
+    return objects
@@ -4,23 +4,66 @@ from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
 from django_filters.rest_framework import DjangoFilterBackend
 from django_filters import rest_framework as filters
 from django.shortcuts import get_object_or_404
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import User
-from django.db.models import Q, Count, Case, When, IntegerField, Subquery
+from django.db import transaction
+from django.db.models import (
+    Q, Case, Count, F, IntegerField, Subquery, Exists, OuterRef, Value, When,
+    prefetch_related_objects
+)
+from django.utils.text import slugify
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from django.utils.decorators import method_decorator
+from django.core.cache import cache
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from .cache import cache_timeout, get_cache_version, record_cache_event
+from .events import get_broker
+from .search import search_movies, search_terms
+from .sampling import MAX_SAMPLE_SIZE, sample
+from .middleware import diagnostics_enabled
+from .notifications import mark_read, unread_count
+from .feed import (
+    FEED_PAGE_SIZE,
+    FEED_MAX_PAGE_SIZE,
+    build_feed,
+    decode_cursor
+)
 from django_filters import rest_framework as filters
-from .utils import create_notification
+from .utils import (
+    create_notification,
+    prefetch_like_targets,
+    set_like_state
+)
+from .pagination import (
+    CursorOrPagePagination,
+    KeysetPagination,
+    OptionalKeysetPagination
+)
 from .models import (
     Movie,
+    Genre,
+    MovieGenre,
+    MovieCast,
+    Person,
     UserProfile,
     Like,
     Comment,
     Ban,
     BanAppeal,
-    Notification
+    Notification,
+    FollowSuggestion,
+    person_slug,
+    with_like_state
 )
 from .serializers import (
     MovieSerializer,
@@ -32,90 +75,247 @@ from .serializers import (
     BanAppealSerializer,
     NotificationSerializer
 )
-import random
+import asyncio
+import hashlib
+import json
 import logging
+import time
 
 logger = logging.getLogger('zaptalk_api.api')
 
+GENRE_CATALOG_TIMEOUT = 60 * 60 * 24
+MAX_SIMILAR_MOVIES = 20
+MOVIE_FACETS_TIMEOUT = 60 * 60
+# sort values ordered by a precomputed MovieRanking score
+RANKING_SORTS = {'popular': 'all_time_score', 'trending': 'trending_score'}
+MAX_CAST_FILTER = 5
+PEOPLE_SEARCH_LIMIT = 20
+
+
+def get_genre_catalog():
+    # Genre names with movie counts, rebuilt once per 'movies' version
+    key = f"genres:catalog:{get_cache_version('movies')}"
+    catalog = cache.get(key)
+    if catalog is None:
+        catalog = list(
+            Genre.objects
+            .annotate(movie_count=Count('movies'))
+            .filter(movie_count__gt=0)
+            .order_by('name')
+            .values('name', 'slug', 'movie_count')
+        )
+        cache.set(key, catalog, cache_timeout(GENRE_CATALOG_TIMEOUT))
+    return catalog
+
+
+def unread_count_etag(request, *args, **kwargs):
+    return f"unread-{request.user.id}-{unread_count(request.user.id)}"
+
+
+def genres_etag(request):
+    variant = 'counts' if request.GET.get('counts') == 'true' else 'names'
+    return f"genres-{variant}-{get_cache_version('movies')}"
+
 
 # Get all the genres
+# ?counts=true also returns the number of movies in each genre
+@condition(etag_func=genres_etag)
 @api_view(['GET'])
 def get_genres(request):
-    genres = Movie.objects.values_list('genres', flat=True)
-    unique_genres = set()
-    for genre_list in genres:
-        if genre_list:  # Check if the list is not None
-            unique_genres.update(genre_list)
-    return Response(sorted(list(unique_genres)))
+    catalog = get_genre_catalog()
+    if request.query_params.get('counts') == 'true':
+        data = catalog
+    else:
+        data = [genre['name'] for genre in catalog]
+    response = Response(data)
+    # Let clients keep their copy but revalidate it with If-None-Match
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+# Actor autocomplete: people whose name starts with ?q=, in name order.
+# ?limit= up to PEOPLE_SEARCH_LIMIT.
+@api_view(['GET'])
+def search_people(request):
+    prefix = person_slug(request.query_params.get('q', ''))
+    if len(prefix) < 2:
+        return Response(
+            {"detail": "q must be at least 2 characters"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        limit = min(
+            max(int(request.query_params.get('limit', 10)), 1),
+            PEOPLE_SEARCH_LIMIT
+        )
+    except ValueError:
+        limit = 10
+    # The range bounds an index scan on the unique slug index (SQLite only
+    # uses indexes for case-insensitive LIKE on NOCASE columns); on
+    # Postgres the slug's varchar_pattern_ops index serves the LIKE
+    people = (
+        Person.objects
+        .filter(
+            slug__gte=prefix,
+            slug__lt=prefix + chr(0x10FFFF),
+            slug__startswith=prefix
+        )
+        .order_by('slug')
+        .values('id', 'name', 'slug')[:limit]
+    )
+    return Response(list(people))
 
 
-# Pagination to only load 24 pages
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 24
-    page_size_query_param = 'page_size'
-    max_page_size = 100
+async def stream_user(request):
+    # EventSource can't send an Authorization header, so the access token
+    # comes in ?token= or the JWT cookie, falling back to the session
+    raw = request.GET.get('token') or request.COOKIES.get(
+        getattr(settings, 'JWT_AUTH_COOKIE', None) or ''
+    )
+    if raw:
+        authentication = JWTAuthentication()
+        try:
+            token = authentication.get_validated_token(raw)
+            return await sync_to_async(authentication.get_user)(token)
+        except AuthenticationFailed:
+            return None
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+async def server_sent_events(broker, user_id):
+    heartbeat = getattr(settings, 'EVENT_STREAM_HEARTBEAT', 15)
+    # Subscribed before the first write, so nothing published while the
+    # client is connecting is lost
+    async with broker.subscribe(user_id) as events:
+        # Ask browsers to wait 5 seconds before reconnecting
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), heartbeat)
+            except asyncio.TimeoutError:
+                # Comment line that keeps proxies from closing the stream
+                yield ': keepalive\n\n'
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+# Server-sent events stream of new notifications and feed items for the
+# current user. Async, so idle connections only hold a coroutine on the
+# ASGI event loop instead of a worker thread.
+async def event_stream(request):
+    # Under WSGI the endless stream would pin a worker thread and never
+    # send a byte, Django buffers async iterators there
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {"detail": "The event stream is only served over ASGI"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    user = await stream_user(request)
+    if user is None:
+        return JsonResponse(
+            {"detail": "Authentication credentials were not provided."},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    broker = get_broker()
+    if broker is None:
+        return JsonResponse(
+            {"detail": "Real-time events are disabled"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    response = StreamingHttpResponse(
+        server_sent_events(broker, user.id),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 class MovieFilter(filters.FilterSet):
     genres = filters.CharFilter(method='filter_genres')
+    cast = filters.CharFilter(method='filter_cast')
     search = filters.CharFilter(method='search_movies')
     sort = filters.CharFilter(method='sort_movies')
     followed_likes = filters.BooleanFilter(method='filter_followed_likes')
 
     class Meta:
         model = Movie
-        fields = ['genres', 'search', 'sort', 'followed_likes']
+        fields = ['genres', 'cast', 'search', 'sort', 'followed_likes']
 
     def filter_genres(self, queryset, name, value):
         genres = [
-            genre.strip().lower()
+            slugify(genre)
             for genre in value.split(',')
             if genre.strip()
         ]
         logger.info(f"Filtering for genres: {genres}")
         if genres:
-            genre_q = Q()
-            for genre in genres:
-                genre_q |= Q(genres__icontains=genre)
-
-            filtered = queryset.filter(genre_q).distinct()
-            logger.info(f"SQL Query: {filtered.query}")
-            logger.info(f"Filtered queryset count: {filtered.count()}")
+            # Semi-join on the indexed genre link table, each movie is
+            # matched at most once so no DISTINCT is needed
+            filtered = queryset.filter(Exists(
+                MovieGenre.objects.filter(
+                    movie=OuterRef('pk'),
+                    genre__slug__in=genres
+                )
+            ))
+            if diagnostics_enabled(self.request):
+                logger.info(f"SQL Query: {filtered.query}")
+                logger.info(f"Filtered queryset count: {filtered.count()}")
             return filtered
         return queryset
 
+    def filter_cast(self, queryset, name, value):
+        # Movies with every listed actor. IN rather than EXISTS, so the
+        # database starts from the actor's few indexed (person, movie)
+        # pairs instead of checking every movie
+        slugs = {person_slug(name) for name in value.split(',')} - {''}
+        if len(slugs) > MAX_CAST_FILTER:
+            raise ValidationError({
+                'cast': f'At most {MAX_CAST_FILTER} actors can be combined.'
+            })
+        for slug in slugs:
+            queryset = queryset.filter(id__in=Subquery(
+                MovieCast.objects.filter(person__slug=slug).values('movie_id')
+            ))
+        return queryset
+
     def search_movies(self, queryset, name, value):
-        return queryset.filter(
-            Q(title__icontains=value) | Q(extract__icontains=value)
-            )
+        return search_movies(queryset, value)
 
     def sort_movies(self, queryset, name, value):
+        # Ordered by the indexed counter columns, with id as a tie-breaker
+        # so keyset pagination can continue from any row
         if value == 'most_liked':
-            return (
-                queryset
-                .annotate(like_count=Count('likes'))
-                .order_by('-like_count')
-            )
+            return queryset.order_by('-likes_count', '-id')
         elif value == 'most_commented':
+            return queryset.order_by('-comments_count', '-id')
+        elif value in RANKING_SORTS:
+            # Scans the ranking's score index; select_related lets keyset
+            # pages read the score of their last row
             return (
                 queryset
-                .annotate(comment_count=Count('comments'))
-                .order_by('-comment_count')
+                .filter(ranking__isnull=False)
+                .select_related('ranking')
+                .order_by(f'-ranking__{RANKING_SORTS[value]}', '-id')
             )
         elif value == 'genres':
-            selected_genres = (
-                self.request.query_params
-                .get('genres', '')
-                .split(',')
-            )
+            selected_genres = [
+                slugify(genre)
+                for genre in (
+                    self.request.query_params
+                    .get('genres', '')
+                    .split(',')
+                )
+                if genre.strip()
+            ]
             return queryset.annotate(
                 matched_genres_count=Count(
-                    Case(
-                        When(genres__name__in=selected_genres, then=1),
-                        output_field=IntegerField()
-                    )
+                    'genre_tags',
+                    filter=Q(genre_tags__slug__in=selected_genres)
                 )
-            ).order_by('-matched_genres_count', 'title')
+            ).order_by('-matched_genres_count', 'title', 'id')
         return queryset
 
     def filter_followed_likes(self, queryset, name, value):
@@ -129,32 +329,111 @@ class MovieFilter(filters.FilterSet):
         return queryset
 
 
+# Anonymous movie list responses are cached per normalized query string.
+# Entries are keyed on the 'movies' version, so any movie change drops
+# them. Likes and comments only move counters, so popularity sorts are
+# also keyed on a time bucket of MOVIE_LIST_STALENESS seconds and other
+# pages may show counts up to MOVIE_LIST_CACHE_TIMEOUT seconds old.
+MOVIE_LIST_CACHE_PARAMS = {'genres', 'cast', 'sort', 'page', 'page_size'}
+POPULARITY_SORTS = {'most_liked', 'most_commented', 'popular', 'trending'}
+
+
+def movie_list_cache_key(request):
+    # None when the response must not be cached
+    params = request.query_params
+    if request.user.is_authenticated or set(params) - MOVIE_LIST_CACHE_PARAMS:
+        return None
+    normalized = {
+        name: params.get(name, '').strip().lower()
+        for name in MOVIE_LIST_CACHE_PARAMS
+    }
+    normalized['genres'] = ','.join(sorted({
+        slugify(genre) for genre in normalized['genres'].split(',')
+        if genre.strip()
+    }))
+    normalized['cast'] = ','.join(sorted({
+        person_slug(name) for name in normalized['cast'].split(',')
+    } - {''}))
+    parts = [
+        'movies:list',
+        str(get_cache_version('movies')),
+    ]
+    if normalized['sort'] in POPULARITY_SORTS:
+        staleness = getattr(settings, 'MOVIE_LIST_STALENESS', 60)
+        parts.append(f"t{int(time.time() // max(staleness, 1))}")
+    # Pagination links are absolute, so the host is part of the key.
+    # Hashed so spaces, control characters and long values fit any cache
+    # backend's keys
+    query = '&'.join(
+        [request.build_absolute_uri('/')]
+        + [f'{name}={normalized[name]}' for name in sorted(normalized)]
+    )
+    parts.append(hashlib.sha1(query.encode()).hexdigest())
+    return ':'.join(parts)
+
+
+# Facet counts only depend on the catalog, so they are cached for everyone
+# under the 'movies' version, keyed on the normalized filters. Only
+# followed_likes depends on the user; those requests are not cached.
+def movie_facets_cache_key(request):
+    params = request.query_params
+    if (
+        params.get('followed_likes', '').lower() == 'true'
+        and request.user.is_authenticated
+    ):
+        return None
+    normalized = '&'.join([
+        'genres=' + ','.join(sorted({
+            slugify(genre) for genre in params.get('genres', '').split(',')
+        } - {''})),
+        'cast=' + ','.join(sorted({
+            person_slug(name) for name in params.get('cast', '').split(',')
+        } - {''})),
+        'search=' + ' '.join(search_terms(params.get('search', ''))),
+    ])
+    # Hashed so long searches fit any cache backend's key size
+    digest = hashlib.sha1(normalized.encode()).hexdigest()
+    return f"movies:facets:{get_cache_version('movies')}:{digest}"
+
+
 class MovieViewSet(viewsets.ModelViewSet):
     queryset = Movie.objects.all()
     serializer_class = MovieSerializer
     permission_classes = [AllowAny]
-    pagination_class = StandardResultsSetPagination
-    filter_backends = [filters.DjangoFilterBackend]
+    # Page numbers by default, ?cursor= for keyset pages
+    pagination_class = CursorOrPagePagination
+    keyset_ordering = ('id',)
+    # get_queryset already applies MovieFilter, running it again through
+    # filter_backends would add every filter condition to the SQL twice
+    filter_backends = []
     filterset_class = MovieFilter
 
     def get_queryset(self):
+        return with_like_state(
+            self.get_filtered_queryset(), self.request.user
+        )
+
+    def get_filtered_queryset(self, params=None):
+        # Catalog movies matching the MovieFilter params, the request's
+        # query parameters by default
+        if params is None:
+            params = self.request.GET
         base_queryset = Movie.objects.filter(
             ~Q(thumbnail__isnull=True) &
             ~Q(thumbnail__exact='')
         )
-        logger.info(f"Base queryset count: {base_queryset.count()}")
-        logger.info(f"Request parameters: {self.request.query_params}")
+        diagnostics = diagnostics_enabled(self.request)
+        if diagnostics:
+            logger.info(f"Base queryset count: {base_queryset.count()}")
+            logger.info(f"Request parameters: {params}")
 
         filtered_queryset = self.filterset_class(
-            self.request.GET,
+            params,
             queryset=base_queryset,
             request=self.request
         ).qs
 
-        followed_likes = (
-            self.request.query_params.get('followed_likes', '')
-            .lower() == 'true'
-        )
+        followed_likes = params.get('followed_likes', '').lower() == 'true'
         if followed_likes and self.request.user.is_authenticated:
             followed_users = (
                 self.request.user.profile.following
@@ -169,42 +448,171 @@ class MovieViewSet(viewsets.ModelViewSet):
                 id__in=Subquery(liked_movies)
             ).distinct()
 
-        logger.info(f"Filtered queryset count: {filtered_queryset.count()}")
-
-        sample_movies = filtered_queryset[:5]
-        logger.info("Sample movies from filtered queryset:")
-        for movie in sample_movies:
-            logger.info(f"- {movie.title} (Genres: {movie.genres})")
+        if diagnostics:
+            logger.info(
+                f"Filtered queryset count: {filtered_queryset.count()}"
+            )
+            sample_movies = filtered_queryset[:5]
+            logger.info("Sample movies from filtered queryset:")
+            for movie in sample_movies:
+                logger.info(f"- {movie.title} (Genres: {movie.genres})")
 
         return filtered_queryset
 
+    def list(self, request, *args, **kwargs):
+        key = movie_list_cache_key(request)
+        if key is None:
+            return self.list_response(request)
+
+        data = cache.get(key)
+        record_cache_event('movie_list', data is not None)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = self.list_response(request)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(
+                key,
+                response.data,
+                cache_timeout(
+                    getattr(settings, 'MOVIE_LIST_CACHE_TIMEOUT', 300)
+                )
+            )
+        response['X-Cache'] = 'MISS'
+        return response
+
+    # One random movie, or a list of ?n= random movies
     @action(detail=False, methods=['get'])
     def random(self, request):
-        queryset = self.get_queryset()
-        count = queryset.count()
-        if count == 0:
+        try:
+            n = int(request.query_params.get('n', 1))
+        except ValueError:
+            n = 0
+        if not 1 <= n <= MAX_SAMPLE_SIZE:
+            return Response(
+                {"detail": f"n must be between 1 and {MAX_SAMPLE_SIZE}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Only the genre filter is cached, other filters build their pool
+        # for this request
+        filters_used = set(request.query_params) - {'n', 'sort'}
+        pool_key = None
+        if filters_used <= {'genres'}:
+            pool_key = ','.join(sorted(
+                slugify(genre)
+                for genre in request.query_params.get('genres', '').split(',')
+                if genre.strip()
+            ))
+
+        movies = sample(self.get_queryset(), n, pool_key)
+        if not movies:
             return Response(
                 {"detail": "No movies with thumbnails available"},
                 status=status.HTTP_404_NOT_FOUND
             )
-        random_index = random.randint(0, count - 1)
-        random_movie = queryset[random_index]
-        serializer = self.get_serializer(random_movie)
-        return Response(serializer.data)
+        if 'n' not in request.query_params:
+            return Response(self.get_serializer(movies[0]).data)
+        return Response(self.get_serializer(movies, many=True).data)
 
-    def list(self, request, *args, **kwargs):
+    # Precomputed similar movies (build_similar_movies), most similar first.
+    # ?limit= up to MAX_SIMILAR_MOVIES. Empty until the movie is built, 404
+    # for movies that don't exist.
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        if not str(pk).isdigit() or not Movie.objects.filter(pk=pk).exists():
+            return Response(
+                {"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+        try:
+            limit = min(
+                max(int(request.query_params.get('limit', 12)), 1),
+                MAX_SIMILAR_MOVIES
+            )
+        except ValueError:
+            limit = 12
+        movies = with_like_state(
+            Movie.objects
+            .filter(similar_to__movie_id=pk)
+            .order_by('similar_to__rank'),
+            request.user
+        )[:limit]
+        return Response(self.get_serializer(movies, many=True).data)
+
+    # Genre and decade counts for the movies matching the MovieFilter
+    # params, in two aggregate queries
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        key = movie_facets_cache_key(request)
+        data = cache.get(key) if key else None
+        if key:
+            record_cache_event('movie_facets', data is not None)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        data = self.facet_counts()
+        response = Response(data)
+        if key:
+            cache.set(key, data, cache_timeout(MOVIE_FACETS_TIMEOUT))
+            response['X-Cache'] = 'MISS'
+        return response
+
+    def facet_counts(self):
+        movies = self.get_filtered_queryset().order_by()
+        # Movies without a year (stored as 0) fall in a null decade.
+        # Counts are distinct because followed_likes joins the likes.
+        decades = list(
+            movies
+            .annotate(decade=Case(
+                When(year__gt=0, then=F('year') / 10 * 10),
+                default=None,
+                output_field=IntegerField()
+            ))
+            .values('decade')
+            .annotate(count=Count('id', distinct=True))
+            .order_by(F('decade').asc(nulls_last=True))
+        )
+
+        # Genres are OR-ed together, so every genre is counted against the
+        # other filters only: its count is what that genre alone matches
+        if 'genres' in self.request.GET:
+            params = self.request.GET.copy()
+            del params['genres']
+            movies = self.get_filtered_queryset(params).order_by()
+        genres = list(
+            movies
+            .filter(genre_tags__isnull=False)
+            .values(name=F('genre_tags__name'), slug=F('genre_tags__slug'))
+            .annotate(count=Count('id', distinct=True))
+            .order_by('-count', 'name')
+        )
+        return {
+            'count': sum(decade['count'] for decade in decades),
+            'genres': genres,
+            'decades': decades,
+        }
+
+    def list_response(self, request):
         queryset = self.filter_queryset(self.get_queryset())
-        logger.info(f"Filtered queryset count: {queryset.count()}")
-        logger.info(f"Request params: {request.query_params}")
+        diagnostics = diagnostics_enabled(request)
+        if diagnostics:
+            logger.info(f"Filtered queryset count: {queryset.count()}")
+            logger.info(f"Request params: {request.query_params}")
 
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
-            logger.info(f"Serialized data length: {len(serializer.data)}")
+            if diagnostics:
+                logger.info(f"Serialized data length: {len(serializer.data)}")
             return self.get_paginated_response(serializer.data)
 
         serializer = self.get_serializer(queryset, many=True)
-        logger.info(f"Serialized data length: {len(serializer.data)}")
+        if diagnostics:
+            logger.info(f"Serialized data length: {len(serializer.data)}")
         return Response(serializer.data)
 
 
@@ -213,8 +621,14 @@ class UserProfileViewSet(viewsets.ModelViewSet):
     serializer_class = UserProfileSerializer
     parser_classes = (MultiPartParser, FormParser)
 
-    def get_object(self):
-        queryset = self.get_queryset()
+    def get_queryset(self):
+        return UserProfile.objects.with_stats(self.request.user)
+
+    def get_object(self, queryset=None):
+        # Actions that don't show the profile itself pass a lighter
+        # queryset than the annotated one
+        if queryset is None:
+            queryset = self.get_queryset()
         lookup_value = self.kwargs.get(self.lookup_field)
 
         if lookup_value.isdigit():
@@ -233,7 +647,7 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         permission_classes=[IsAuthenticated]
     )
     def me(self, request):
-        profile = request.user.profile
+        profile = self.get_queryset().get(user=request.user)
 
         if request.method == 'GET':
             serializer = self.get_serializer(profile)
@@ -284,129 +698,190 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         permission_classes=[IsAuthenticated]
     )
     def feed(self, request):
-        user = request.user
-        following = user.profile.following.all()
-        following_users = [profile.user for profile in following]
-        comments = Comment.objects.filter(
-            user__in=following_users
-        ).order_by('-created_at')
-        likes = Like.objects.filter(
-            user__in=following_users
-        ).order_by('-created_at')
-        comments_serializer = CommentSerializer(
+        try:
+            cursor = request.query_params.get('cursor')
+            cursor = decode_cursor(cursor) if cursor else None
+            page_size = min(
+                int(request.query_params.get('page_size', FEED_PAGE_SIZE)),
+                FEED_MAX_PAGE_SIZE
+            )
+        except ValueError:
+            return Response(
+                {"detail": "Invalid cursor or page_size."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        page, next_cursor = build_feed(
+            request.user, cursor, max(page_size, 1)
+        )
+
+        # Load the related rows for this page only, one query per relation
+        comments = [item for item in page if item.feed_type == 'comment']
+        likes = [item for item in page if item.feed_type == 'like']
+        prefetch_related_objects(comments, 'user__profile', 'movie')
+        set_like_state(comments, request.user)
+        prefetch_like_targets(likes)
+        comment_data = iter(CommentSerializer(
             comments,
             many=True,
             context={'request': request}
-        )
-        likes_serializer = LikeSerializer(likes, many=True)
-        comment_items = [
-            dict(item, **{'type': 'comment'})
-            for item in comments_serializer.data
-        ]
-        like_items = [
-            dict(item, **{'type': 'like'})
-            for item in likes_serializer.data
+        ).data)
+        like_data = iter(LikeSerializer(likes, many=True).data)
+
+        feed_items = [
+            dict(
+                next(comment_data if item.feed_type == 'comment'
+                     else like_data),
+                **{'type': item.feed_type}
+            )
+            for item in page
         ]
-        feed_items = sorted(
-            comment_items + like_items,
-            key=lambda x: x['created_at'],
-            reverse=True
-        )
-        return Response(feed_items)
+        next_url = None
+        if next_cursor:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'cursor', next_cursor
+            )
+        return Response({'next': next_url, 'results': feed_items})
 
+    # Precomputed "who to follow" for the current user, best first.
+    # ?limit= up to 20. Accounts followed since the last rebuild of the
+    # suggestions (build_follow_suggestions) are left out.
     @action(
-        detail=True, methods=['post'],
+        detail=False, methods=['get'],
         permission_classes=[IsAuthenticated]
     )
-    def follow(self, request, pk=None):
+    def suggestions(self, request):
         try:
-            user_to_follow = self.get_object()
-            user = request.user.profile
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 20)
+        except ValueError:
+            limit = 10
+        suggestions = (
+            FollowSuggestion.objects
+            .filter(user=request.user)
+            .exclude(suggested__profile__followers__user=request.user)
+            .select_related('suggested__profile')
+            .order_by('rank')[:limit]
+        )
+        return Response([
+            {
+                'user_id': suggestion.suggested.id,
+                'profile_id': suggestion.suggested.profile.id,
+                'username': suggestion.suggested.username,
+                'avatar': (
+                    suggestion.suggested.profile.avatar.url
+                    if suggestion.suggested.profile.avatar else None
+                ),
+                'score': round(suggestion.score, 4)
+            }
+            for suggestion in suggestions
+        ])
+
+    # POST toggles the follow, PUT follows and DELETE unfollows; PUT and
+    # DELETE can be repeated safely
+    @action(
+        detail=True, methods=['post', 'put', 'delete'],
+        permission_classes=[IsAuthenticated]
+    )
+    def follow(self, request, pk=None):
+        user_to_follow = self.get_object(
+            UserProfile.objects.select_related('user')
+        )
+        user = request.user.profile
 
-            if user == user_to_follow:
-                return Response(
-                    {"detail": "You cannot follow yourself."},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        if user == user_to_follow:
+            return Response(
+                {"detail": "You cannot follow yourself."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-            if user in user_to_follow.followers.all():
-                user_to_follow.followers.remove(user)
-                return Response(
-                    {
-                        "detail": (
-                            f"You have unfollowed "
-                            f"{user_to_follow.user.username}."
-                        )
-                    },
-                    status=status.HTTP_200_OK
-                )
-            else:
-                user_to_follow.followers.add(user)
+        if request.method == 'PUT':
+            following = True
+        elif request.method == 'DELETE':
+            following = False
+        else:
+            following = not user.follows(user_to_follow)
+
+        if following:
+            if user.follow(user_to_follow):
                 create_notification(
                     user_to_follow.user,
                     request.user,
                     'follow'
                 )
-                return Response(
-                    {
-                        "detail": (
-                            f"You are now following "
-                            f"{user_to_follow.user.username}."
-                        )
-                    },
-                    status=status.HTTP_200_OK
-                )
-        except UserProfile.DoesNotExist:
-            return Response(
-                {"detail": "User not found."},
-                status=status.HTTP_404_NOT_FOUND
-            )
+            detail = f"You are now following {user_to_follow.user.username}."
+        else:
+            user.unfollow(user_to_follow)
+            detail = f"You have unfollowed {user_to_follow.user.username}."
+        return Response(
+            {"detail": detail, "following": following},
+            status=status.HTTP_200_OK
+        )
+
+    def keyset_page(self, queryset, serialize):
+        # Follower lists can be huge, so they are always cursor paginated
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(queryset, self.request, self)
+        return paginator.get_paginated_response(serialize(page))
+
+    def profile_page(self, queryset):
+        return self.keyset_page(
+            queryset,
+            lambda page: self.get_serializer(page, many=True).data
+        )
 
     @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
     def followers(self, request, pk=None):
-        user = self.get_object()
-        followers = user.followers.all()
-        serializer = self.get_serializer(followers, many=True)
-        return Response(serializer.data)
+        user = self.get_object(UserProfile.objects.all())
+        return self.profile_page(self.get_queryset().filter(following=user))
 
     # Following, shown on other users for example
     @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
     def following(self, request, pk=None):
-        user = self.get_object()
-        following = user.following.all()
-        serializer = self.get_serializer(following, many=True)
-        return Response(serializer.data)
+        user = self.get_object(UserProfile.objects.all())
+        return self.profile_page(self.get_queryset().filter(followers=user))
+
+    # Profiles that follow this user and are followed back, as the
+    # INTERSECT of the two sides of the follow graph
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
+    def mutual(self, request, pk=None):
+        user = self.get_object(UserProfile.objects.all())
+        follows = UserProfile.followers.through.objects
+        mutual = follows.filter(from_userprofile=user).values_list(
+            'to_userprofile', flat=True
+        ).intersection(
+            follows.filter(to_userprofile=user).values_list(
+                'from_userprofile', flat=True
+            )
+        )
+        return self.profile_page(
+            self.get_queryset().filter(pk__in=mutual)
+        )
 
     # List of users you follow, shown on your profile page
     @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
     def following_list(self, request, pk=None):
-        try:
-            if pk == 'me':
-                user_profile = request.user.profile
-            else:
-                user_profile = self.get_object()
+        if pk == 'me':
+            user_profile = request.user.profile
+        else:
+            user_profile = self.get_object(UserProfile.objects.all())
 
-            following = user_profile.following.all()
-            following_data = [
+        return self.keyset_page(
+            user_profile.following.select_related('user'),
+            lambda page: [
                 {
                     'user_id': profile.user.id,
                     'profile_id': profile.id,
                     'username': profile.user.username,
                     'avatar': profile.avatar.url if profile.avatar else None
                 }
-                for profile in following
+                for profile in page
             ]
-            return Response(following_data, status=status.HTTP_200_OK)
-        except UserProfile.DoesNotExist:
-            return Response(
-                {"detail": "User not found."},
-                status=status.HTTP_404_NOT_FOUND
-            )
+        )
 
     @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
     def likes(self, request, pk=None):
         user = self.get_object()
-        likes = Like.objects.filter(user=user.user)
+        likes = prefetch_like_targets(Like.objects.filter(user=user.user))
         serializer = LikeSerializer(likes, many=True)
         return Response(serializer.data)
 
@@ -420,27 +895,79 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         return Response({'is_banned': is_banned})
 
 
+LIKE_STATE_MAX_IDS = 100
+
+
+def parse_ids(value):
+    ids = {int(pk) for pk in value.split(',') if pk.strip()}
+    if len(ids) > LIKE_STATE_MAX_IDS or any(pk < 1 for pk in ids):
+        raise ValueError(value)
+    return ids
+
+
 class LikeViewSet(viewsets.ModelViewSet):
     queryset = Like.objects.all()
     serializer_class = LikeSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CursorOrPagePagination
 
     def list(self, request):
         try:
-            likes = Like.objects.filter(
+            likes = prefetch_like_targets(Like.objects.filter(
                 content_type__in=[
                     Movie.get_default_like_content_type(),
                     Comment.get_default_like_content_type()
                 ]
-            ).order_by('-created_at')
-            serializer = self.get_serializer(likes, many=True)
-            return Response(serializer.data)
+            ).order_by('-created_at', '-id'))
         except Exception as e:
             logger.error(f"Error in LikeViewSet list: {str(e)}")
             return Response(
                 {"detail": "An error occurred while fetching likes"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+        # Outside the try block, so an out of range page or a bad cursor
+        # is DRF's 404 rather than a 500
+        page = self.paginate_queryset(likes)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    # Like state of many movies and comments at once, for grids and
+    # threads: ?movies=1,2,3&comments=4,5 (up to 100 ids each).
+    # Returns {"movies": {id: {"is_liked", "likes_count"}}, "comments": ...}
+    # from a single UNION query.
+    @action(detail=False, methods=['get'], permission_classes=[AllowAny])
+    def state(self, request):
+        try:
+            ids = {
+                kind: parse_ids(request.query_params.get(kind, ''))
+                for kind in ('movies', 'comments')
+            }
+        except ValueError:
+            return Response(
+                {"detail": (
+                    f"movies and comments must be comma separated ids, "
+                    f"at most {LIKE_STATE_MAX_IDS} each"
+                )},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        queries = [
+            with_like_state(model.objects.filter(pk__in=ids[kind]),
+                            request.user)
+            .annotate(kind=Value(kind))
+            .values_list('kind', 'id', 'likes_count', 'is_liked_by_user')
+            for kind, model in (('movies', Movie), ('comments', Comment))
+            if ids[kind]
+        ]
+        data = {'movies': {}, 'comments': {}}
+        if queries:
+            rows = queries[0].union(*queries[1:])
+            for kind, pk, likes_count, is_liked in rows:
+                data[kind][pk] = {
+                    'is_liked': bool(is_liked),
+                    'likes_count': likes_count
+                }
+        return Response(data)
 
     @action(detail=False, methods=['post'])
     def toggle_like(self, request):
@@ -468,24 +995,31 @@ class LikeViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            like, created = Like.objects.get_or_create(
-                user=user,
-                content_type=content_type,
-                object_id=object_id
-            )
+            # The counter signals on Like run inside this transaction, so the
+            # like row and the denormalized likes_count commit together
+            with transaction.atomic():
+                like, created = Like.objects.get_or_create(
+                    user=user,
+                    content_type=content_type,
+                    object_id=object_id
+                )
 
-            if created:
-                if recipient and recipient != user:
-                    create_notification(recipient, user, 'like')
-                is_liked = True
-            else:
-                like.delete()
-                is_liked = False
+                if created:
+                    if recipient and recipient != user:
+                        create_notification(
+                            recipient, user, 'like', object_id=comment.pk
+                        )
+                    is_liked = True
+                else:
+                    like.delete()
+                    is_liked = False
 
-            likes_count = Like.objects.filter(
-                content_type=content_type,
-                object_id=object_id
-            ).count()
+            likes_count = (
+                content_type.model_class().objects
+                .filter(pk=object_id)
+                .values_list('likes_count', flat=True)
+                .first()
+            ) or 0
 
             return Response({
                 "is_liked": is_liked,
@@ -514,6 +1048,20 @@ class CommentViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend]  # Enable filtering
     filterset_class = CommentFilter  # Attach the filter class
+    # 24 per page by default, ?cursor= for keyset pages
+    pagination_class = CursorOrPagePagination
+
+    def get_queryset(self):
+        # Everything CommentSerializer reads comes from this one statement:
+        # the author with their profile and the movie joined in, likes_count
+        # from the counter column and the like state as an EXISTS subquery
+        comments = (
+            Comment.objects
+            .select_related('user__profile', 'movie')
+            .defer('movie__extract', 'movie__cast', 'movie__genres')
+            .order_by('-created_at', '-id')
+        )
+        return with_like_state(comments, self.request.user)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -522,7 +1070,13 @@ class CommentViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         # Assign the authenticated user to the comment
-        serializer.save(user=self.request.user)
+        # and bump Movie.comments_count in the same transaction
+        with transaction.atomic():
+            serializer.save(user=self.request.user)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
 
 
 # Bans
@@ -610,18 +1164,26 @@ class BanAppealViewSet(viewsets.ModelViewSet):
 class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OptionalKeysetPagination
 
     def get_queryset(self):
         return Notification.objects.filter(recipient=self.request.user)
 
     @action(detail=False, methods=['post'])
     def mark_all_as_read(self, request):
-        self.get_queryset().update(is_read=True)
+        mark_read(self.get_queryset())
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
         notification = self.get_object()
-        notification.is_read = True
-        notification.save()
+        mark_read(self.get_queryset().filter(pk=notification.pk))
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+    # Number of unread notifications for the badge, read from a counter
+    # instead of the notification list. Send If-None-Match to get a 304
+    # while it hasn't changed.
+    @action(detail=False, methods=['get'])
+    @method_decorator(condition(etag_func=unread_count_etag))
+    def unread_count(self, request):
+        return Response({'unread_count': unread_count(request.user.id)})
@@ -57,6 +57,7 @@ SITE_ID = 1
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'api.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -90,10 +91,14 @@ WSGI_APPLICATION = 'movieapi.wsgi.application'
 
 # Database configuration
 if os.environ.get('DATABASE_URL'):
+    # The web dyno runs under ASGI, where sync ORM code runs in thread
+    # pools whose persistent connections are never closed at the end of a
+    # request. Close them after each request unless a pooler (pgbouncer)
+    # sits in front of Postgres.
     DATABASES = {
         'default': dj_database_url.config(
             default=os.environ['DATABASE_URL'],
-            conn_max_age=600
+            conn_max_age=int(os.environ.get('DB_CONN_MAX_AGE', 0))
         )
     }
 else:
@@ -104,6 +109,34 @@ else:
         }
     }
 
+# Cache
+# Redis when REDIS_URL is set, the database cache table (created by
+# `manage.py createcachetable`) with CACHE_BACKEND=database, otherwise
+# per-process local memory. The response caches and their version counters
+# need a shared backend to stay consistent across dynos; with local memory
+# every cached entry expires after LOCAL_CACHE_MAX_TIMEOUT seconds instead
+# (see api/cache.py).
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+elif os.environ.get('CACHE_BACKEND') == 'database':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'zaptalk_cache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -193,6 +226,12 @@ if 'CLIENT_ORIGIN_DEV' in os.environ:
             CORS_ALLOWED_ORIGINS.append(client_origin_dev)
 
 CORS_ALLOW_CREDENTIALS = True
+CORS_EXPOSE_HEADERS = [
+    'X-DB-Query-Count',
+    'X-DB-Query-Time',
+    'X-DB-Duplicate-Queries',
+    'Server-Timing',
+]
 
 CSRF_TRUSTED_ORIGINS = [
     "https://8000-petterjohans-zaptalkapi-crwv2ijg0nb.ws.codeinstitute-ide.net"
@@ -227,7 +266,7 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': (
-        'django_filters.rest_framework.DjangoFilterBackend'
+        'django_filters.rest_framework.DjangoFilterBackend',
     ),
 }
 
@@ -259,6 +298,57 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
 
+# Query instrumentation (api/middleware.py)
+# Diagnostics run for requests sending the X-Debug-Queries header (with this
+# token outside DEBUG) and for a random share of requests
+QUERY_DIAGNOSTICS_TOKEN = os.environ.get('QUERY_DIAGNOSTICS_TOKEN')
+QUERY_DIAGNOSTICS_SAMPLE_RATE = float(
+    os.environ.get('QUERY_DIAGNOSTICS_SAMPLE_RATE', 0)
+)
+# Requests running more queries than this are logged as warnings
+QUERY_BUDGET = 50
+
+# Feed timelines
+# Fan-out-on-write copies new comments and likes into each follower's
+# timeline. Authors with more followers than the limit are read on demand.
+TIMELINE_FANOUT = os.environ.get('TIMELINE_FANOUT') == 'True'
+TIMELINE_FANOUT_MAX_FOLLOWERS = int(
+    os.environ.get('TIMELINE_FANOUT_MAX_FOLLOWERS', 5000)
+)
+TIMELINE_BACKFILL_LIMIT = 200
+
+# Notification outbox (api/notifications.py)
+# Events are turned into notifications by the process_notifications worker,
+# or right after the request commits when NOTIFICATION_OUTBOX_SYNC is on
+# (the default in development). Repeats within the window are coalesced.
+NOTIFICATION_OUTBOX_SYNC = os.environ.get(
+    'NOTIFICATION_OUTBOX_SYNC', str(DEBUG)
+) == 'True'
+NOTIFICATION_COALESCE_WINDOW = 60 * 60
+
+# Anonymous movie list cache (MovieViewSet.list)
+# Seconds a cached page may be served, and for the most_liked and
+# most_commented sorts the seconds their order may lag behind new likes
+# and comments
+MOVIE_LIST_CACHE_TIMEOUT = int(os.environ.get('MOVIE_LIST_CACHE_TIMEOUT', 300))
+MOVIE_LIST_STALENESS = int(os.environ.get('MOVIE_LIST_STALENESS', 60))
+
+# Longest any versioned cache entry lives in the per-process memory cache
+LOCAL_CACHE_MAX_TIMEOUT = int(os.environ.get('LOCAL_CACHE_MAX_TIMEOUT', 60))
+
+# Movie rankings (api/rankings.py) behind sort=popular and sort=trending,
+# refreshed by the refresh_rankings command. Each like and comment counts
+# half as much towards trending every half-life (seconds).
+TRENDING_HALF_LIFE = int(os.environ.get('TRENDING_HALF_LIFE', 60 * 60 * 72))
+
+# Real-time events (api/events.py), streamed from /api/events/
+# 'memory' reaches streams served by the same process, 'postgres' uses
+# LISTEN/NOTIFY to reach every web process and the notification worker.
+# Empty turns the stream and event publishing off.
+EVENT_BROKER = os.environ.get('EVENT_BROKER', 'memory' if DEBUG else '')
+# Seconds between keepalive comments on idle streams
+EVENT_STREAM_HEARTBEAT = 15
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,